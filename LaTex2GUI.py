@@ -1,3 +1,5 @@
+import math
+
 from PyQt5 import QtGui, QtWidgets, QtCore
 
 from matplotlib.figure import Figure
@@ -34,7 +36,7 @@ class MathTextLabel(QtWidgets.QWidget):
         h = y1 - y0
 
         self._figure.set_size_inches(w / 80, h / 80)
-        self.setFixedSize(w, h)
+        self.setFixedSize(math.ceil(w), math.ceil(h))
 
     def updateText(self, mathText):
         text = self._figure.suptitle(
@@ -50,7 +52,7 @@ class MathTextLabel(QtWidgets.QWidget):
         w = x1 - x0
         h = y1 - y0
         self._figure.set_size_inches(w / 80, h / 80)
-        self.setFixedSize(w, h)
+        self.setFixedSize(math.ceil(w), math.ceil(h))
 
 
 if __name__ == '__main__':
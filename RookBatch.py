@@ -0,0 +1,96 @@
+import math
+
+import numpy as np
+
+MAX_SIDE = 16  # Largest shorter side solve_batch sweeps, 2**MAX_SIDE states
+CHUNK_STATES = 1 << 16  # Boards times states swept at once, kept in cache
+
+
+def solve_batch(rows, width):
+    """
+    Solves a stack of boards of the same size at once. Sweeps the rows of all
+    boards together, holding for every board the number of placements in the
+    rows so far that use each subset of the columns, so the rook number r_k
+    sums the subsets of k columns. Boards wider than they are tall are
+    transposed first.
+    :param rows: array-like of shape (N, h) of row bitmasks as in Board.board,
+                 column j of a row at bit width - 1 - j
+    :param width: number of columns of every board
+    :return: int64 array of shape (N, min(h, width) + 1), row n holding the
+             coefficients of the rook polynomial of board n, or an object
+             array if the counts could overflow int64
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    if rows.ndim != 2:
+        raise ValueError("rows must have shape (boards, height)")
+    if width < 0 or width > 62 or ((rows < 0) | (rows >> width != 0)).any():
+        raise ValueError("rows must be bitmasks of %d columns" % width)
+    n, h = rows.shape
+    if width > h:
+        rows, h, width = _transpose(rows, width), width, h
+    if width > MAX_SIDE:
+        raise ValueError("boards larger than %d in both dimensions"
+                         % MAX_SIDE)
+    k = min(h, width)
+    # The number of partial placements of k rooks bounds every count
+    bound = max(math.comb(h, j) * math.comb(width, j) * math.factorial(j)
+                for j in range(k + 1))
+    # Narrower counts halve the memory traffic of the sweep
+    dtype = np.int32 if bound < 2**31 else \
+        np.int64 if bound < 2**63 else object
+    # Maps each column subset to the number of rooks it holds
+    sizes = np.array([state.bit_count() for state in range(1 << width)])
+    by_size = (np.arange(k + 1)[:, None] == sizes).astype(dtype)
+    coefs = np.empty((n, k + 1), dtype=np.int64 if dtype is not object
+                     else object)
+    chunk = max(1, CHUNK_STATES >> width)
+    for start in range(0, n, chunk):
+        counts = _sweep(rows[start:start + chunk], width, dtype)
+        coefs[start:start + chunk] = (by_size @ counts).T
+    return coefs
+
+
+def solve_boards(boards):
+    """
+    :param boards: sequence of Board of the same height and width
+    :return: coefficient matrix of solve_batch for the boards
+    """
+    if not boards:
+        return np.zeros((0, 1), dtype=np.int64)
+    width = boards[0].width
+    if any(board.width != width or len(board.board) != len(boards[0].board)
+           for board in boards):
+        raise ValueError("boards must all have the same size")
+    return solve_batch([board.board for board in boards], width)
+
+
+def _transpose(rows, width):
+    """
+    :return: column bitmasks of every board, row i stored at bit h - 1 - i
+    """
+    h = rows.shape[1]
+    bits = rows[:, :, None] >> np.arange(width - 1, -1, -1) & 1
+    return (bits << np.arange(h - 1, -1, -1)[None, :, None]).sum(axis=1)
+
+
+def _sweep(rows, width, dtype):
+    """
+    :return: array of shape (2**width, N) of the number of placements using
+             each subset of the columns, bit b of a subset standing for the
+             column at bit b of the rows. Boards run along the last axis so
+             every update is over contiguous memory
+    """
+    n = rows.shape[0]
+    allowed = (rows[:, :, None] >> np.arange(width) & 1).astype(dtype)
+    counts = np.zeros((1 << width, n), dtype=dtype)
+    counts[0] = 1
+    for i in range(rows.shape[1]):
+        placed = counts.copy()
+        for b in range(width):
+            # Split subsets on bit b, a rook in the column adds it to a
+            # subset without it
+            before = counts.reshape(-1, 2, 1 << b, n)
+            after = placed.reshape(-1, 2, 1 << b, n)
+            after[:, 1] += before[:, 0] * allowed[:, i, b]
+        counts = placed
+    return counts
@@ -0,0 +1,317 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import RookPolynomials as rp
+
+
+def random_board(rng, n, density):
+    """
+    :return: (height, width, forbidden cells) of an n x n board with each cell
+             forbidden with the given probability
+    """
+    return n, n, {(i, j) for i in range(n) for j in range(n)
+                  if rng.random() < density}
+
+
+def band_board(rng, n, half_width):
+    """
+    :return: n x n board allowing only the cells within half_width of the
+             diagonal
+    """
+    return n, n, {(i, j) for i in range(n) for j in range(n)
+                  if abs(i - j) > half_width}
+
+
+def staircase_board(rng, n, extra):
+    """
+    :return: n x n Ferrers staircase, row i allowing its first i + 1 cells,
+             with extra random cells above the stairs allowed as well so the
+             board is not a Ferrers board when extra > 0
+    """
+    forbidden = {(i, j) for i in range(n) for j in range(i + 1, n)}
+    for cell in rng.sample(sorted(forbidden), min(extra, len(forbidden))):
+        forbidden.discard(cell)
+    return n, n, forbidden
+
+
+def near_full_board(rng, n, holes):
+    """
+    :return: n x n board with `holes` random forbidden cells
+    """
+    return n, n, {(rng.randrange(n), rng.randrange(n)) for _ in range(holes)}
+
+
+def board_cases(quick=False):
+    """
+    Board families as (name, generator, n, parameter) tuples. The long band
+    runs as many rows as the interpreter's recursion limit, the depth the
+    recursive solver used to fail at.
+    """
+    long_band = sys.getrecursionlimit()
+    cases = [
+        ("random", random_board, 8, 0.3),
+        ("random", random_board, 12, 0.5),
+        ("random", random_board, 14, 0.7),
+        ("band", band_board, 60, 2),
+        ("band", band_board, 200, 3),
+        ("staircase", staircase_board, 30, 0),
+        ("staircase", staircase_board, 16, 6),
+        ("near_full", near_full_board, 20, 5),
+        ("near_full", near_full_board, 60, 8),
+        ("long_band", band_board, long_band, 1),
+    ]
+    if not quick:
+        cases += [
+            ("random", random_board, 16, 0.5),
+            ("random", random_board, 16, 0.7),
+            ("band", band_board, 400, 4),
+            ("staircase", staircase_board, 20, 10),
+            ("near_full", near_full_board, 100, 10),
+        ]
+    return cases
+
+
+def timed(fn, *args):
+    """
+    :return: result of fn and its wall time in seconds
+    """
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(fn, *args):
+    """
+    :return: peak bytes allocated by Python while running fn
+    """
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_solve(h, w, forbidden, repeats):
+    """
+    Cold runs start from an empty POLYNOMIAL_CACHE, warm runs reuse what the
+    cold run left in it. Peak memory is measured in a separate cold run, as
+    tracing slows the solver down.
+    :return: dict of the best cold and warm times, peak memory and degree
+    """
+    cold = warm = float("inf")
+    for _ in range(repeats):
+        rp.Board.POLYNOMIAL_CACHE.clear()
+        board = rp.Board(h, w, forbidden)
+        R_of_B, seconds = timed(board.solve)
+        cold = min(cold, seconds)
+        warm = min(warm, timed(rp.Board(h, w, forbidden).solve)[1])
+    rp.Board.POLYNOMIAL_CACHE.clear()
+    peak = peak_memory(rp.Board(h, w, forbidden).solve)
+    return {"cold_seconds": cold, "warm_seconds": warm, "peak_bytes": peak,
+            "degree": R_of_B.degree(),
+            "checksum": sum(R_of_B.coefs) % 1000000007}
+
+
+def bench_sampling(h, w, forbidden, draws):
+    """
+    :return: dict of the time of the first draw of a maximum placement, which
+             fills the count memo, and the mean time of the draws after it
+    """
+    rp.Board.POLYNOMIAL_CACHE.clear()
+    board = rp.Board(h, w, forbidden)
+    num_rooks = board.solve().degree()
+    first = timed(board.disp_random_config, num_rooks)[1]
+    rest = timed(board.sample_configs, num_rooks, draws)[1]
+    return {"rooks": num_rooks, "first_draw_seconds": first,
+            "draw_seconds": rest / draws}
+
+
+def bench_toggle(h, w, forbidden, toggles, rng):
+    """
+    :return: dict of the mean and worst time of toggle_cells on a single
+             random cell of a solved board, as each click in the GUI does.
+             Every toggle is undone before the next so that all of them
+             start from the same board.
+    """
+    rp.Board.POLYNOMIAL_CACHE.clear()
+    board = rp.Board(h, w, forbidden)
+    board.solve()
+    times = []
+    for _ in range(toggles):
+        cell = [(rng.randrange(h), rng.randrange(w))]
+        times.append(timed(board.toggle_cells, cell)[1])
+        board.toggle_cells(cell)
+    return {"toggles": toggles, "toggle_seconds": sum(times) / toggles,
+            "worst_toggle_seconds": max(times)}
+
+
+def bench_gui(n, clicks, rng):
+    """
+    Times the board widget of RookGUI on an n x n board, on the offscreen
+    platform unless QT_QPA_PLATFORM says otherwise: building its items,
+    painting all of it, redrawing it unchanged as a new solve does and
+    repainting after a click
+    :return: dict of the times, None if PyQt5 is not installed
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5 import QtWidgets
+        import RookGUI
+    except ImportError:
+        return None
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    view = RookGUI.Board(n, n)
+    view.show()
+    app.processEvents()
+    view.builtFor = None  # Built by the constructor already
+    build = timed(view.drawBoard)[1]
+    paint = timed(view.viewport().repaint)[1]
+    redraw = timed(view.drawBoard)[1]
+
+    def click(cell):
+        # What the press handlers of Square and BoardItem do, short of
+        # starting the polynomial update
+        view.badCells ^= {cell}
+        if view.boardItem is not None:
+            view.boardItem.update(view.boardItem.cellRect(cell))
+        else:
+            square = view.squares[cell]
+            square.bad = not square.bad
+            square.update()
+        app.processEvents()
+
+    times = [timed(click, (rng.randrange(n), rng.randrange(n)))[1]
+             for _ in range(clicks)]
+    view.close()
+    return {"batched": view.boardItem is not None, "build_seconds": build,
+            "paint_seconds": paint, "redraw_seconds": redraw,
+            "click_seconds": sum(times) / clicks}
+
+
+def bench_arithmetic(rng, degree, bits, repeats):
+    """
+    :return: dict of the mean time of each Polynomial operation on random
+             polynomials of the given degree with coefficients of `bits` bits
+    """
+    a = rp.Polynomial([rng.getrandbits(bits) for _ in range(degree + 1)])
+    b = rp.Polynomial([rng.getrandbits(bits) for _ in range(degree + 1)])
+    ops = {
+        "add": lambda: a + b,
+        "sub": lambda: a - b,
+        "mul": lambda: a * b,
+        "add_shifted": lambda: a.add_shifted(b, 1),
+    }
+    results = {}
+    for name, op in ops.items():
+        start = time.perf_counter()
+        for _ in range(repeats):
+            op()
+        results[name + "_seconds"] = (time.perf_counter() - start) / repeats
+    return results
+
+
+def run(seed=0, quick=False, repeats=3, gui=True):
+    """
+    Runs every benchmark with boards drawn from a Random seeded by seed.
+    Toggles and clicks draw their cells from Randoms of their own, so the
+    boards stay the same as in runs without them.
+    :param gui: whether to time the RookGUI board widget as well
+    :return: JSON-serializable dict of the environment and the results
+    """
+    rng = random.Random(seed)
+    random.seed(seed)  # Used by disp_random_config
+    results = []
+    for family, make, n, param in board_cases(quick):
+        h, w, forbidden = make(rng, n, param)
+        name = "%s_%d_%s" % (family, n, param)
+        results.append({"name": "solve/" + name, "family": family,
+                        "size": n, "param": param,
+                        **bench_solve(h, w, forbidden, repeats)})
+        if n <= 30:
+            results.append({"name": "sample/" + name, "family": family,
+                            "size": n, "param": param,
+                            **bench_sampling(h, w, forbidden,
+                                             10 if quick else 50)})
+        if n <= 60:
+            results.append({"name": "toggle/" + name, "family": family,
+                            "size": n, "param": param,
+                            **bench_toggle(h, w, forbidden,
+                                           10 if quick else 50,
+                                           random.Random("toggle/%s/%d"
+                                                         % (name, seed)))})
+    for degree, bits in [(10, 64), (100, 256), (400, 1024)]:
+        results.append({"name": "arith/%d_%d" % (degree, bits),
+                        "degree": degree, "bits": bits,
+                        **bench_arithmetic(rng, degree, bits,
+                                           20 if quick else 200)})
+    for n in (8, 24, 100):
+        result = bench_gui(n, 20 if quick else 100,
+                           random.Random("gui/%d/%d" % (n, seed))) \
+            if gui else None
+        if result is not None:
+            results.append({"name": "gui/%d" % n, "size": n, **result})
+    return {"meta": {"seed": seed, "quick": quick, "repeats": repeats,
+                     "python": platform.python_version(),
+                     "platform": platform.platform()},
+            "results": results}
+
+
+def compare(old, new):
+    """
+    :return: lines giving the ratio new / old of every time both runs share
+    """
+    old_results = {result["name"]: result for result in old["results"]}
+    lines = []
+    for result in new["results"]:
+        before = old_results.get(result["name"])
+        if before is None:
+            continue
+        for key, value in result.items():
+            if key.endswith("_seconds") and before.get(key):
+                lines.append("%-40s %-20s %7.2fx" % (
+                    result["name"], key, value / before[key]))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="RookBenchmarks",
+        description="Times the rook polynomial solver on seeded board families "
+                    "and writes the results as JSON.")
+    parser.add_argument("-o", "--output", default="-",
+                        help="file for the JSON results, - for stdout")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the board generator")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="solves per board, the best time is kept")
+    parser.add_argument("--quick", action="store_true",
+                        help="skip the slowest boards")
+    parser.add_argument("--no-gui", action="store_true",
+                        help="skip the timings of the Qt board widget")
+    parser.add_argument("--compare",
+                        help="earlier JSON results to print time ratios "
+                             "against, on stderr")
+    args = parser.parse_args(argv)
+
+    results = run(args.seed, args.quick, args.repeats, not args.no_gui)
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as out:
+            out.write(text + "\n")
+    if args.compare:
+        with open(args.compare) as src:
+            for line in compare(json.load(src), results):
+                print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
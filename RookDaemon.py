@@ -0,0 +1,321 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import errno
+import json
+import os
+import random
+import socket
+import stat
+import tempfile
+import threading
+
+import RookPolynomials as rp
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "rook-daemon.sock")
+
+
+def board_record(board):
+    """
+    :return: JSON-serializable dict of the board in the JSONL format of
+             RookPolynomials solve
+    """
+    w = board.width
+    return {"height": len(board.board), "width": w,
+            "forbidden": [[i, j] for i, row in enumerate(board.board)
+                          for j in range(w) if not row >> (w - 1 - j) & 1]}
+
+
+def parse_board(record):
+    """
+    :return: Board described by a request record
+    """
+    try:
+        return rp.Board(int(record["height"]), int(record["width"]),
+                        {(int(i), int(j))
+                         for i, j in record.get("forbidden", ())})
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError("invalid board: %s" % e)
+
+
+class Daemon:
+    """
+    Serves rook polynomials over a Unix domain socket from one warm
+    POLYNOMIAL_CACHE. Requests are JSON lines
+    {"op": "solve" | "coefficient" | "sample", "height": h, "width": w,
+    "forbidden": [[i, j], ...]}, with "k" for a coefficient and "rooks",
+    "count" and optionally "seed" for samples. Each gets one JSON line back
+    holding the result or an "error", copying any "id" field. Requests for
+    a board already being solved wait for that solve instead of starting
+    their own.
+    """
+    MAX_SAMPLERS = 32  # Boards whose placement counts are kept for sampling
+    LINE_LIMIT = 64 * 2**20  # Longest request line in bytes
+
+    def __init__(self, path=DEFAULT_SOCKET, cache_mb=256, store=None,
+                 threads=4):
+        """
+        :param store: path of a SQLite file shared as a persistent cache
+        :param threads: solver threads, more than one so that cache hits are
+                        not queued behind a long solve
+        """
+        self.path = path
+        rp.Board.POLYNOMIAL_CACHE = rp.PolynomialCache(
+            max_bytes=int(cache_mb * 2**20),
+            store=rp.PolynomialStore(store) if store else None)
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.in_flight = {}  # Request key to the future of its result
+        self.samplers = collections.OrderedDict()  # Rows to (Board, lock)
+        self.samplers_lock = threading.Lock()
+        self.served = 0
+        self.coalesced = 0
+
+    async def serve(self):
+        """
+        Listens on the socket until cancelled
+        :raises OSError: if another daemon is listening on the socket
+        """
+        if os.path.exists(self.path) and \
+                stat.S_ISSOCK(os.stat(self.path).st_mode):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.unlink(self.path)  # Left behind by a daemon that was killed
+            else:
+                raise OSError(errno.EADDRINUSE,
+                              "a daemon is already listening", self.path)
+            finally:
+                probe.close()
+        server = await asyncio.start_unix_server(self.handle, self.path,
+                                                 limit=self.LINE_LIMIT)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def handle(self, reader, writer):
+        """
+        Answers the requests of one connection, concurrently and in order
+        of completion, so clients pair requests and answers by "id"
+        """
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def answer(line):
+            result = await self.respond(line)
+            async with lock:
+                writer.write(json.dumps(result).encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while (line := await self.read_line(reader)) != b"":
+                if line is None or line.strip():
+                    task = asyncio.create_task(answer(line))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def read_line(self, reader):
+        """
+        :return: next request line, b"" at the end of the stream or None for
+                 a line longer than LINE_LIMIT, which is skipped
+        """
+        too_long = False
+        while True:
+            try:
+                line = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                line = e.partial  # Last line without a newline
+            except asyncio.LimitOverrunError as e:
+                await reader.readexactly(e.consumed)  # Drop what is buffered
+                too_long = True
+                continue
+            return None if too_long else line
+
+    async def respond(self, line):
+        """
+        :param line: request line, None if it was too long to read
+        :return: dict answering one request line
+        """
+        record = {}
+        try:
+            if line is None:
+                raise ValueError("request longer than %d bytes"
+                                 % self.LINE_LIMIT)
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("request must be a JSON object")
+            result = await self.dispatch(record)
+        except ValueError as e:
+            result = {"error": str(e)}
+        except Exception as e:  # Keep serving whatever one request does
+            result = {"error": "%s: %s" % (type(e).__name__, e)}
+        self.served += 1
+        if "id" in record:
+            result = {"id": record["id"], **result}
+        return result
+
+    async def dispatch(self, record):
+        op = record.get("op", "solve")
+        board = parse_board(record)
+        rows = tuple(board.board)
+        if op == "solve":
+            poly = await self.coalesce(("solve", rows, board.width),
+                                       board.solve)
+            return {"coefficients": poly.coefs}
+        if op == "coefficient":
+            k = int(record["k"])
+            poly = await self.coalesce(("solve", rows, board.width),
+                                       board.solve)
+            return {"coefficient": poly.coefs[k] if 0 <= k < len(poly) else 0}
+        if op == "sample":
+            args = (int(record["rooks"]), int(record.get("count", 1)),
+                    record.get("seed"))
+            if args[2] is None:
+                # Unseeded requests must not share their draws
+                configs = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, self.sample, board, *args)
+            else:
+                configs = await self.coalesce(
+                    ("sample", rows, board.width) + args,
+                    self.sample, board, *args)
+            return {"placements": [sorted(config) for config in configs]}
+        raise ValueError("unknown op %r" % op)
+
+    async def coalesce(self, key, fn, *args):
+        """
+        Runs fn on the solver threads unless an identical request is already
+        running, in which case its result is shared
+        :return: result of fn
+        """
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, fn, *args)
+        self.in_flight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+
+    def sample(self, board, num_rooks, count, seed):
+        """
+        Samples from a kept Board of the same rows, whose placement counts
+        are already filled in by earlier requests
+        :return: list of count sets of (row, column) cells
+        """
+        key = (tuple(board.board), board.width)
+        with self.samplers_lock:
+            if key in self.samplers:
+                self.samplers.move_to_end(key)
+            else:
+                self.samplers[key] = (board, threading.Lock())
+                if len(self.samplers) > self.MAX_SAMPLERS:
+                    self.samplers.popitem(last=False)
+            board, lock = self.samplers[key]
+        rng = random if seed is None else random.Random(seed)
+        with lock:
+            return board.sample_configs(num_rooks, count, rng)
+
+
+class Client:
+    """
+    Blocking client of a Daemon, solving boards like Board.solve does
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile("rwb")
+        self.next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def request(self, board, op, **fields):
+        """
+        :return: dict answering the request
+        :raises ValueError: if the daemon answers with an error
+        """
+        self.next_id += 1
+        record = {"id": self.next_id, "op": op, **board_record(board),
+                  **fields}
+        self.stream.write(json.dumps(record).encode() + b"\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("daemon closed the connection")
+        result = json.loads(line)
+        if "error" in result:
+            raise ValueError(result["error"])
+        return result
+
+    def solve(self, board):
+        """
+        :return: rook polynomial of the board
+        """
+        return rp.Polynomial(self.request(board, "solve")["coefficients"])
+
+    def coefficient(self, board, k):
+        """
+        :return: number of placements of k non-attacking rooks
+        """
+        return self.request(board, "coefficient", k=k)["coefficient"]
+
+    def sample_configs(self, board, num_rooks, count, seed=None):
+        """
+        :return: list of count sets of (row, column) cells, see
+                 Board.sample_configs
+        """
+        placements = self.request(board, "sample", rooks=num_rooks,
+                                  count=count, seed=seed)["placements"]
+        return [{tuple(cell) for cell in placement}
+                for placement in placements]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="RookDaemon",
+        description="Serves rook polynomials over a Unix domain socket from "
+                    "one warm cache.")
+    parser.add_argument("-s", "--socket", default=DEFAULT_SOCKET,
+                        help="path of the socket")
+    parser.add_argument("--cache-mb", type=float, default=256,
+                        help="memory budget of the polynomial cache")
+    parser.add_argument("--store",
+                        help="SQLite file shared as a persistent cache")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="solver threads")
+    args = parser.parse_args(argv)
+
+    daemon = Daemon(args.socket, args.cache_mb, args.store, args.threads)
+    try:
+        asyncio.run(daemon.serve())
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        parser.exit(1, "RookDaemon: error: %s\n" % e)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
+import functools
 import sys
+import threading
 from PyQt5 import QtGui as qg
 from PyQt5 import QtWidgets as qw
 from PyQt5 import QtCore as qc
@@ -48,16 +50,19 @@ class RPSolver(qw.QMainWindow):
         resetBtn.clicked.connect(self.reset)
         dispConfigBtn = qw.QPushButton("Display", self)
         dispConfigBtn.clicked.connect(self.board.dispPlacement)
+        cancelBtn = qw.QPushButton("Cancel", self)
+        cancelBtn.setStatusTip("Stops the running solve (Esc)")
+        cancelBtn.clicked.connect(self.board.cancel)
 
 
         # Comboboxes
         self.xCombo = qw.QComboBox(self)
         self.xCombo.label = "xCombo"
-        self.xCombo.addItems(str(n) for n in range(1, 11))
+        self.xCombo.addItems(str(n) for n in range(1, 101))
         self.xCombo.setCurrentIndex(7)  # Default to 8 for 8x8 board
         self.yCombo = qw.QComboBox(self)
         self.yCombo.label = "yCombo"
-        self.yCombo.addItems(str(n) for n in range(1, 11))
+        self.yCombo.addItems(str(n) for n in range(1, 101))
         self.yCombo.setCurrentIndex(7)  # Default to 8 for 8x8 board
 
         self.xCombo.activated[str].connect(self.comboActivated)
@@ -78,6 +83,7 @@ class RPSolver(qw.QMainWindow):
         grid.addWidget(solveBtn, 4, 0)
         grid.addWidget(resetBtn, 3, 0)
         grid.addWidget(dispConfigBtn, 5, 0)
+        grid.addWidget(cancelBtn, 6, 0)
         grid.addWidget(self.board, 1, 2, 9, 8)
         # Must be row 10 so that board doesn't intersect
         grid.addWidget(self.board.polyLabel, 10, 0, 1, 8)
@@ -124,13 +130,17 @@ class RPSolver(qw.QMainWindow):
                                         qw.QMessageBox.No,
                                         qw.QMessageBox.No)
         if reply == qw.QMessageBox.Yes:
+            self.board.dropTask()
             e.accept()
         else:
             e.ignore()
 
     def keyPressEvent(self, e):
         if e.key() == qc.Qt.Key_Escape:
-            self.close()
+            if self.board.task is not None:
+                self.board.cancel()
+            else:
+                self.close()
         elif e.key() == qc.Qt.Key_Return:
             self.board.solve()
 
@@ -143,15 +153,61 @@ class RPSolver(qw.QMainWindow):
             self.board.x = int(val)
         else:
             self.board.y = int(val)
+        self.board.dropTask()  # Results for the old size are stale
+        self.board.rpBoard = None
+        self.board.polynomial = None
+        self.board.pendingCells = []
+        self.board.sampler = None
         self.board.drawBoard()  # Repaint the board
 
 
+class Task(qc.QRunnable):
+    """
+    Runs a solver call on a QThreadPool thread and reports the outcome
+    through signals tagged with the board's generation when started
+    """
+    class Signals(qc.QObject):
+        done = qc.pyqtSignal(int, object)
+        failed = qc.pyqtSignal(int, str)
+
+    def __init__(self, generation, fn, *args):
+        super().__init__()
+        self.generation = generation
+        self.fn = fn
+        self.args = args
+        self.signals = Task.Signals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args)
+        except rp.SolveCancelled:
+            return  # Whoever cancelled has already moved on
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+            return
+        self.signals.done.emit(self.generation, result)
+
+
 class Board(qw.QGraphicsView):
+    MAX_PIXELS = 400  # Cells shrink so the board fits in this many pixels
+    MIN_CELL = 4
+    BATCH_CELLS = 24 * 24  # Larger boards are painted by a single BoardItem
+
     def __init__(self, x=8, y=8, parent=None):
         super().__init__()
+        # Background work, results from older generations are dropped
+        self.pool = qc.QThreadPool.globalInstance()
+        self.task = None
+        self.toggling = False  # Whether the task updates self.polynomial
+        self.cancelEvent = None
+        self.solveStats = None  # SolveStats of the running solve
+        self.generation = 0
+        self.progressTimer = qc.QTimer(self)
+        self.progressTimer.timeout.connect(self.showProgress)
         self.initUI(x, y, parent)
 
     def initUI(self, x=8, y=8, parent=None):
+        self.dropTask()
         # Default to 8x8 board
         self.x = x
         self.y = y
@@ -160,13 +216,20 @@ class Board(qw.QGraphicsView):
         self.polyLabel = l2g.MathTextLabel("Select bad cells and click Solve"
                                            + " or hit Enter")
         self.polynomial = None
-        sqrDim = 40
+        self.rpBoard = None  # Solved board kept for incremental updates
+        self.pendingCells = []  # Toggles waiting for the running update
+        self.sampler = None  # Board reused across Display draws
+        self.squares = {}  # (row, column) -> Square on small boards
+        self.boardItem = None  # Paints every cell of large boards
+        self.rookItems = []
+        self.builtFor = None  # Size and mode the items were built for
+        self.cellSize = 40
         color = self.palette().color(qg.QPalette.Background)
 
         # Set scene to same size as view and color as window
-        self.setMaximumSize(400, 400)
+        self.setMaximumSize(self.MAX_PIXELS, self.MAX_PIXELS)
 
-        self.setFixedSize(self.x * sqrDim, self.y * sqrDim)
+        self.setFixedSize(self.x * self.cellSize, self.y * self.cellSize)
         rcontent = self.contentsRect()
         self.scene = qw.QGraphicsScene()
         self.scene.setBackgroundBrush(qg.QBrush(color))
@@ -176,13 +239,33 @@ class Board(qw.QGraphicsView):
         # set QGraphicsView attributes
         self.setRenderHints(qg.QPainter.Antialiasing |
             qg.QPainter.HighQualityAntialiasing)
-        self.setViewportUpdateMode(qw.QGraphicsView.FullViewportUpdate)
+        # Only the cells that changed are repainted
+        self.setViewportUpdateMode(qw.QGraphicsView.MinimalViewportUpdate)
 
         self.drawBoard()
 
     def drawBoard(self):
+        # Clears placed rooks and brings the cells in line with badCells,
+        # building the cell items again only when the board size changes
+        for rook in self.rookItems:
+            self.scene.removeItem(rook)
+        self.rookItems = []
+        sqrDim = max(self.MIN_CELL,
+                     min(40, self.MAX_PIXELS // max(self.x, self.y)))
+        batched = self.x * self.y > self.BATCH_CELLS
+        if self.builtFor == (self.x, self.y, sqrDim, batched):
+            if self.boardItem is not None:
+                self.boardItem.update()
+            for cell, square in self.squares.items():
+                if square.bad != (cell in self.badCells):
+                    square.bad = cell in self.badCells
+                    square.update()
+            return
+        self.builtFor = (self.x, self.y, sqrDim, batched)
+        self.cellSize = sqrDim
         self.scene.clear()
-        sqrDim = 40
+        self.squares = {}
+        self.boardItem = None
 
         self.setFixedSize(self.x * sqrDim, self.y * sqrDim)
 
@@ -190,19 +273,136 @@ class Board(qw.QGraphicsView):
         self.setSceneRect(0, 0, rcontent.width(), rcontent.height())
         self.setScene(self.scene)
 
+        if batched:
+            self.boardItem = BoardItem(self)
+            self.scene.addItem(self.boardItem)
+            return
         for i in range(self.x):
             for j in range(self.y):
-                square = Square(i * 40, j * 40, self)
+                square = Square(i * sqrDim, j * sqrDim, self, sqrDim)
                 if (j, i) in self.badCells:
                     square.bad = True
-                square.setFlag(qw.QGraphicsItem.ItemIsSelectable, True)
-                square.setAcceptHoverEvents(True)
+                self.squares[(j, i)] = square
                 self.scene.addItem(square)
 
+    def startTask(self, message, onDone, rpBoard, fn, *args, solveStats=None):
+        # Runs fn on the thread pool, rpBoard checking for cancellation.
+        # Progress comes from solveStats when fn fills one in, otherwise from
+        # the cache counters
+        self.dropTask()
+        self.cancelEvent = threading.Event()
+        rpBoard.cancel = self.cancelEvent
+        self.task = Task(self.generation, fn, *args)
+        self.task.signals.done.connect(
+            lambda generation, result: self.taskDone(generation, result, onDone))
+        self.task.signals.failed.connect(self.taskFailed)
+        self.taskMessage = message
+        self.taskStats = rp.Board.POLYNOMIAL_CACHE.stats()
+        self.solveStats = solveStats
+        self.showProgress()
+        self.progressTimer.start(200)
+        self.pool.start(self.task)
+
+    def dropTask(self):
+        # Cancels the running task and ignores whatever it still reports
+        self.generation += 1
+        if self.cancelEvent is not None:
+            self.cancelEvent.set()
+        self.task = None
+        self.toggling = False
+        self.cancelEvent = None
+        self.progressTimer.stop()
+
+    def cancel(self):
+        if self.task is None:
+            return
+        if self.toggling:
+            # The solved board is somewhere between the edits, so start over
+            self.rpBoard = None
+            self.polynomial = None
+            self.pendingCells = []
+        self.dropTask()
+        self.parent.statusBar().showMessage("Cancelled")
+
+    def taskDone(self, generation, result, onDone):
+        if generation != self.generation:
+            return  # Stale result of a dropped task
+        self.task = None
+        self.toggling = False
+        self.cancelEvent = None
+        self.progressTimer.stop()
+        self.parent.statusBar().showMessage("Ready")
+        onDone(result)
+
+    def taskFailed(self, generation, message):
+        if generation != self.generation:
+            return
+        self.dropTask()
+        self.parent.statusBar().showMessage("Failed: " + message)
+
+    def showProgress(self):
+        if self.solveStats is not None:
+            self.parent.statusBar().showMessage(
+                "%s %d subboards expanded, %d cache hits, depth %d "
+                "(Esc to cancel)"
+                % (self.taskMessage, self.solveStats.nodes,
+                   self.solveStats.cache_hits, self.solveStats.max_depth))
+            return
+        # Subboards missing from the cache are the ones expanded
+        stats = rp.Board.POLYNOMIAL_CACHE.stats()
+        self.parent.statusBar().showMessage(
+            "%s %d subboards expanded, %d cache hits (Esc to cancel)"
+            % (self.taskMessage, stats["misses"] - self.taskStats["misses"],
+               stats["hits"] - self.taskStats["hits"]))
+
     def solve(self):
         self.drawBoard()
         rpBoard = rp.Board(self.y, self.x, self.badCells)
-        self.polynomial = rpBoard.solve()
+        self.rpBoard = None
+        self.polynomial = None
+        self.pendingCells = []
+        stats = rp.SolveStats()
+        self.startTask("Solving...",
+                       lambda poly: self.solved(rpBoard, poly, stats),
+                       rpBoard, rpBoard.solve, None, stats, solveStats=stats)
+
+    def solved(self, rpBoard, polynomial, stats):
+        self.rpBoard = rpBoard
+        self.polynomial = polynomial
+        self.showPolynomial()
+        message = "Solved: %d subboards expanded, %d cache hits, depth %d" % (
+            stats.nodes, stats.cache_hits, stats.max_depth)
+        if stats.seconds:
+            kind, seconds = stats.seconds.most_common(1)[0]
+            message += ", most time in %s (%.3f s)" % (kind, seconds)
+        self.parent.statusBar().showMessage(message)
+
+    def toggleCell(self, row, col):
+        # Keeps a solved polynomial current one clicked cell at a time
+        self.sampler = None
+        if self.task is not None and not self.toggling:
+            self.dropTask()  # A solve or draw for the board before the click
+            self.parent.statusBar().showMessage("Board edited, result dropped")
+        if self.polynomial is None or self.rpBoard is None:
+            return
+        self.pendingCells.append((row, col))
+        if self.task is None:
+            self.startToggles()
+
+    def startToggles(self):
+        # Applies every click made so far in one toggle_cells call
+        cells, self.pendingCells = self.pendingCells, []
+        self.startTask("Updating...", self.toggled, self.rpBoard,
+                       self.rpBoard.toggle_cells, cells)
+        self.toggling = True
+
+    def toggled(self, polynomial):
+        self.polynomial = polynomial
+        self.showPolynomial()
+        if self.pendingCells:
+            self.startToggles()
+
+    def showPolynomial(self):
         latex = self.polynomial.latexFormat()
         self.polyLabel.updateText(latex)
         centralWidget = self.parent.centralWidget()
@@ -210,6 +410,9 @@ class Board(qw.QGraphicsView):
         print(latex)
 
     def dispPlacement(self):
+        if self.task is not None:
+            self.parent.statusBar().showMessage("Busy, press Esc to cancel")
+            return
         self.drawBoard()
         if self.polynomial != None:
             num_rooks = self.polynomial.degree()
@@ -223,58 +426,91 @@ class Board(qw.QGraphicsView):
                                                 items, num_rooks, False)
         if not ok:
             return
-        rpBoard = rp.Board(self.y, self.x, self.badCells)
-        rooks = rpBoard.disp_random_config(int(num_rooks))
-        blk_rook_img = qg.QPixmap("images/black_rook.png")
-        wht_rook_img = qg.QPixmap("images/white_rook.png")
+        if self.sampler is None:
+            self.sampler = rp.Board(self.y, self.x, self.badCells)
+        self.startTask("Placing rooks...", self.placeRooks, self.sampler,
+                       self.sampler.disp_random_config, int(num_rooks))
+
+    def placeRooks(self, rooks):
+        sqrDim = self.cellSize
         for rook in rooks:
-            if (rook[0] + rook[1]) % 2:
-                wht_rook = qw.QGraphicsPixmapItem(wht_rook_img)
-                wht_rook.setX(rook[1] * 40)
-                wht_rook.setY(rook[0] * 40)
-                self.scene.addItem(wht_rook)
-            else:
-                blk_rook = qw.QGraphicsPixmapItem(blk_rook_img)
-                blk_rook.setX(rook[1] * 40)
-                blk_rook.setY(rook[0] * 40)
-                self.scene.addItem(blk_rook)
+            # White rooks on the black squares and the other way round
+            color = "white" if (rook[0] + rook[1]) % 2 else "black"
+            item = qw.QGraphicsPixmapItem(rookPixmap(color, sqrDim))
+            item.setX(rook[1] * sqrDim)
+            item.setY(rook[0] * sqrDim)
+            self.scene.addItem(item)
+            self.rookItems.append(item)
+
+@functools.lru_cache(maxsize=None)
+def paintTools():
+    """
+    Pens and brushes shared by every cell, made once on first use
+    """
+    return {
+        "hoverPen": qg.QPen(qc.Qt.red, 2, qc.Qt.DashLine, qc.Qt.RoundCap),
+        "bad": qg.QBrush(qc.Qt.gray, qc.Qt.DiagCrossPattern),
+        "black": qg.QBrush(qg.QColor(0x000000)),
+        "white": qg.QBrush(qg.QColor(0xffffff)),
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def rookPixmap(color, size):
+    return qg.QPixmap("images/%s_rook.png" % color).scaled(
+        size, size, qc.Qt.KeepAspectRatio, qc.Qt.SmoothTransformation)
+
+
+@functools.lru_cache(maxsize=None)
+def checkerBrush(size):
+    """
+    :return: brush tiling a 2 x 2 cell checkerboard pixmap
+    """
+    tile = qg.QPixmap(2 * size, 2 * size)
+    tile.fill(qg.QColor(0xffffff))
+    painter = qg.QPainter(tile)
+    painter.fillRect(size, 0, size, size, qg.QColor(0x000000))
+    painter.fillRect(0, size, size, size, qg.QColor(0x000000))
+    painter.end()
+    return qg.QBrush(tile)
+
+
+def paintHover(painter, x, y, size):
+    painter.setPen(paintTools()["hoverPen"])
+    painter.setBrush(paintTools()["bad"])
+    painter.drawRect(x, y, size - 1, size - 1)
+    painter.drawLine(x, y, x + size, y + size)
+    painter.drawLine(x + size, y, x, y + size)
+
 
 class Square(qw.QGraphicsItem):
-    def __init__(self, x, y, board, image=None):
+    def __init__(self, x, y, board, size=40, image=None):
         super(Square, self).__init__()
         self.parent = board
-        self.pen = qg.QPen()
-        self.pen.setColor(qg.QColor(0x000000))
 
         # Holds rook image when placing rooks on board
         self.image = qw.QGraphicsPixmapItem(image) if image is not None else None
 
-        self.brush = qg.QBrush()
-
         self.x = x
         self.y = y
+        self.size = size
         self.bad = False
 
-        self.rect = qc.QRectF(self.x, self.y, 40, 40)
+        self.rect = qc.QRectF(self.x, self.y, size, size)
 
         self.setFlag(qw.QGraphicsItem.ItemIsSelectable, True)
         self.setAcceptHoverEvents(True)
 
-    # def hoverEnterEvent(self, event):
-    #     print(self.parent)
-    #     qw.QGraphicsItem.hoverEnterEvent(self, event)
-    #
-    # def hoverLeaveEvent(self, event):
-    #     print("goodbye")
-    #     qw.QGraphicsItem.hoverLeaveEvent(self, event)
-
     def mousePressEvent(self, event):
         # select object
         self.bad = self.bad ^ True  # toggle bad cell on click
+        cell = (self.y // self.size, self.x // self.size)
         if self.bad:
-            self.parent.badCells.add((self.y//40, self.x//40))
+            self.parent.badCells.add(cell)
         else:
-            self.parent.badCells.remove((self.y//40, self.x//40))
+            self.parent.badCells.remove(cell)
+        self.update()
+        self.parent.toggleCell(*cell)
         qw.QGraphicsItem.mousePressEvent(self, event)
 
     def mouseReleaseEvent(self, event):
@@ -286,27 +522,83 @@ class Square(qw.QGraphicsItem):
     def paint(self, painter, option, widget):
         painter.setPen(qc.Qt.NoPen)
         if option.state & qw.QStyle.State_MouseOver:
-            pen = qg.QPen(qc.Qt.red, 2, qc.Qt.DashLine, qc.Qt.RoundCap)
-            painter.setPen(pen)
-            painter.setBrush(qg.QBrush(qc.Qt.gray, qc.Qt.DiagCrossPattern))
-
-            painter.drawRect(self.x, self.y, 39, 39)
-            painter.drawLine(self.x, self.y, self.x + 40, self.y + 40)
-            painter.drawLine(self.x + 40, self.y, self.x, self.y + 40)
+            paintHover(painter, self.x, self.y, self.size)
             return
 
         if self.bad:
-            badBrush = qg.QBrush(qc.Qt.gray, qc.Qt.DiagCrossPattern)
-            painter.setBrush(badBrush)
-            painter.drawRect(self.x, self.y, 40, 40)
+            painter.setBrush(paintTools()["bad"])
+        elif (self.x // self.size + self.y // self.size) & 1:  # Creates alternating white/black
+            painter.setBrush(paintTools()["black"])
+        else:
+            painter.setBrush(paintTools()["white"])
+        painter.drawRect(self.x, self.y, self.size, self.size)
+
+
+class BoardItem(qw.QGraphicsItem):
+    """
+    Every cell of a large board in one item. The squares are one fill with a
+    tiled checkerboard brush, the bad cells in view one drawRects call, and
+    clicks and hovering repaint only the cells involved.
+    """
+    def __init__(self, board):
+        super().__init__()
+        self.parent = board
+        self.hover = None  # Cell under the mouse
+        self.setAcceptHoverEvents(True)
+        self.setFlag(qw.QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+    def boundingRect(self):
+        size = self.parent.cellSize
+        return qc.QRectF(0, 0, self.parent.x * size, self.parent.y * size)
+
+    def cellAt(self, pos):
+        size = self.parent.cellSize
+        row, col = int(pos.y() // size), int(pos.x() // size)
+        if 0 <= row < self.parent.y and 0 <= col < self.parent.x:
+            return row, col
+        return None
+
+    def cellRect(self, cell):
+        size = self.parent.cellSize
+        return qc.QRectF(cell[1] * size, cell[0] * size, size, size)
+
+    def mousePressEvent(self, event):
+        cell = self.cellAt(event.pos())
+        if cell is None:
             return
+        self.parent.badCells ^= {cell}  # toggle bad cell on click
+        self.update(self.cellRect(cell))
+        self.parent.toggleCell(*cell)
+
+    def hoverMoveEvent(self, event):
+        cell = self.cellAt(event.pos())
+        if cell != self.hover:
+            for old in (self.hover, cell):
+                if old is not None:
+                    self.update(self.cellRect(old))
+            self.hover = cell
+
+    def hoverLeaveEvent(self, event):
+        if self.hover is not None:
+            self.update(self.cellRect(self.hover))
+        self.hover = None
 
-        if (self.x//40 + self.y//40) & 1:  # Creates alternating white/black
-            painter.setBrush(qg.QColor(0x000000))
-            painter.drawRect(self.x, self.y, 40, 40)
-        else:
-            painter.setBrush(qg.QColor(0xffffff))
-            painter.drawRect(self.x, self.y, 40, 40)
+    def paint(self, painter, option, widget):
+        exposed = option.exposedRect
+        painter.setPen(qc.Qt.NoPen)
+        painter.fillRect(exposed, checkerBrush(self.parent.cellSize))
+        bad = [self.cellRect(cell) for cell in self.parent.badCells]
+        bad = [rect for rect in bad if rect.intersects(exposed)]
+        if bad:
+            # Bad cells show the window color through their pattern
+            painter.setBrush(self.parent.scene.backgroundBrush())
+            painter.drawRects(bad)
+            painter.setBrush(paintTools()["bad"])
+            painter.drawRects(bad)
+        if self.hover is not None:
+            rect = self.cellRect(self.hover)
+            paintHover(painter, int(rect.x()), int(rect.y()),
+                       self.parent.cellSize)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,27 @@
-import copy
+import argparse
+import array
+import collections
+import concurrent.futures
+import functools
+import json
 import math
+import operator
+import os
+import sqlite3
+import sys
+import threading
 import time
 import random
 
-# TODO: Reimplement this class using collections.Counters and not lists
 class Polynomial:
+    """
+    Immutable polynomial with integer coefficients in a tuple, lowest degree
+    first. Hashable, so equal polynomials can be shared or used as keys.
+    """
+    __slots__ = ("coefs",)
+
     def __init__(self, coefs):
-        self.coefs = coefs
+        self.coefs = tuple(coefs)
 
     def __repr__(self):
         prnt_str = ""
@@ -21,49 +36,71 @@ class Polynomial:
             prnt_str = prnt_str[3:]
         return prnt_str
 
-    def __add__(self, other):
-        poly = Polynomial([])
-        if len(other.coefs) > len(self.coefs):
-            for i in range(len(other.coefs)):
-                if i < len(self.coefs):
-                    poly.coefs.append(self.coefs[i] + other.coefs[i])
-                else:
-                    poly.coefs.append(other.coefs[i])
-        else:
-            for i in range(len(self.coefs)):
-                if i < len(other.coefs):
-                    poly.coefs.append(self.coefs[i] + other.coefs[i])
-                else:
-                    poly.coefs.append(self.coefs[i])
+    def __eq__(self, other):
+        return isinstance(other, Polynomial) and self.coefs == other.coefs
 
-        return poly
+    def __hash__(self):
+        return hash(self.coefs)
+
+    @staticmethod
+    def accumulate(acc, coefs, shift=0):
+        """
+        Adds coefs moved up by shift degrees into the coefficient list acc in
+        place, extending it as needed
+        """
+        end = shift + len(coefs)
+        if len(acc) < end:
+            acc.extend([0] * (end - len(acc)))
+        acc[shift:end] = map(operator.add, acc[shift:end], coefs)
+
+    def shift(self, k):
+        """
+        :return: the polynomial times x**k
+        """
+        return Polynomial((0,) * k + self.coefs)
+
+    def add_shifted(self, other, k):
+        """
+        :return: self + other * x**k without building the product
+        """
+        acc = list(self.coefs)
+        self.accumulate(acc, other.coefs, k)
+        return Polynomial(acc)
+
+    def __add__(self, other):
+        return self.add_shifted(other, 0)
 
     def __sub__(self, other):
-        poly = Polynomial([])
-        for i in range(len(other.coefs)):
-            if i < len(self.coefs):
-                poly.coefs.append(self.coefs[i] - other.coefs[i])
-            else:
-                poly.coefs.append(0 - other.coefs[i])
-        return poly
+        acc = list(self.coefs)
+        self.accumulate(acc, [-coef for coef in other.coefs])
+        return Polynomial(acc)
 
     def __mul__(self, other):
-        poly = Polynomial([0] * (len(self.coefs) + len(other.coefs) - 1))  # Length is sum of highest degree + 1
-        for deg1, coef1 in enumerate(self.coefs):
-            for deg2, coef2 in enumerate(other.coefs):
-                # Multiplies coefficients and places them in the index related to
-                # the sum of the degrees of x
-                poly.coefs[deg1 + deg2] += coef1 * coef2
-        return poly
+        short, long = sorted((self.coefs, other.coefs), key=len)
+        acc = [0] * (len(short) + len(long) - 1)  # Length is sum of highest degree + 1
+        for deg, coef in enumerate(short):
+            # Adds the long factor scaled by coef, moved up by deg degrees
+            if coef:
+                self.accumulate(acc, [coef * c for c in long], deg)
+        return Polynomial(acc)
+
+    def __mod__(self, modulus):
+        return Polynomial([coef % modulus for coef in self.coefs])
 
     def __len__(self):
         return len(self.coefs)
 
+    def trim(self):
+        """
+        :return: the polynomial without zero coefficients above its degree
+        """
+        return Polynomial(self.coefs[:self.degree() + 1])
+
     def degree(self):
-        poly = self.coefs[:]
-        while poly[-1] == 0:
-            poly.pop()
-        return len(poly) - 1
+        deg = len(self.coefs) - 1
+        while deg > 0 and self.coefs[deg] == 0:
+            deg -= 1
+        return deg
 
     def latexFormat(self):
         """
@@ -77,12 +114,250 @@ class Polynomial:
         return prnt_str
 
 
+class PolynomialStore:
+    """
+    Persistent rook polynomial store in an SQLite database. Runs in WAL mode so
+    several local processes can read and write the same file concurrently.
+    """
+    def __init__(self, path, timeout=30.0):
+        """
+        :param path: database file, created if missing
+        :param timeout: seconds to wait on a writer holding the database lock
+        """
+        self.path = path
+        self.timeout = timeout
+        self.__local = threading.local()
+        self.__connect().execute(
+            "CREATE TABLE IF NOT EXISTS rook_polynomials "
+            "(board BLOB PRIMARY KEY, coefs TEXT NOT NULL)")
+
+    def __connect(self):
+        # Connections are per thread and must not be reused across a fork
+        conn = getattr(self.__local, "conn", None)
+        if conn is None or self.__local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.__local.conn = conn
+            self.__local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        """
+        :param key: packed board from PolynomialCache.pack_key
+        :return: list of coefficients, None if the board is not stored
+        """
+        row = self.__connect().execute(
+            "SELECT coefs FROM rook_polynomials WHERE board = ?",
+            (key,)).fetchone()
+        if row is None:
+            return None
+        return [int(coef) for coef in row[0].split(",")]
+
+    def put(self, key, coefs):
+        # Coefficients are stored as text since they outgrow SQLite integers
+        self.__connect().execute(
+            "INSERT OR IGNORE INTO rook_polynomials VALUES (?, ?)",
+            (key, ",".join(str(coef) for coef in coefs)))
+
+    def __len__(self):
+        return self.__connect().execute(
+            "SELECT COUNT(*) FROM rook_polynomials").fetchone()[0]
+
+
+class PolynomialCache:
+    """
+    Thread-safe LRU cache of rook polynomials keyed by canonical boards.
+    Any object with get() and item assignment (a plain dict for instance) can
+    stand in for it as Board.POLYNOMIAL_CACHE.
+    """
+    ENTRY_OVERHEAD = 120  # Approximate bytes of bookkeeping per entry
+
+    def __init__(self, max_entries=None, max_bytes=None, store=None):
+        """
+        :param max_entries: maximum number of cached boards, None for no limit
+        :param max_bytes: approximate memory budget in bytes, None for no limit
+        :param store: optional PolynomialStore consulted on a miss and
+                      written through on every new entry
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store = store
+        self.nbytes = 0
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = collections.OrderedDict()
+        self.__lock = threading.RLock()
+
+    @staticmethod
+    def pack_key(rows):
+        """
+        :return: bytes holding the row bitmasks at a fixed width per row
+        """
+        row_bytes = (max(rows, default=0).bit_length() + 7) // 8
+        return row_bytes.to_bytes(2, "big") + b"".join(
+            row.to_bytes(row_bytes, "big") for row in rows)
+
+    @staticmethod
+    def __pack_coefs(coefs):
+        if all(0 <= coef < 1 << 64 for coef in coefs):
+            return array.array("Q", coefs)
+        return tuple(coefs)  # Coefficients too large for machine words
+
+    @staticmethod
+    def __sizeof(key, coefs):
+        size = sys.getsizeof(key) + sys.getsizeof(coefs)
+        if isinstance(coefs, tuple):
+            size += sum(sys.getsizeof(coef) for coef in coefs)
+        return size + PolynomialCache.ENTRY_OVERHEAD
+
+    def __contains__(self, rows):
+        with self.__lock:
+            return self.pack_key(rows) in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, rows, default=None):
+        key = self.pack_key(rows)
+        with self.__lock:
+            coefs = self.__entries.get(key)
+            if coefs is not None:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return Polynomial(coefs)
+        coefs = self.store.get(key) if self.store is not None else None
+        with self.__lock:
+            if coefs is None:
+                self.misses += 1
+                return default
+            self.store_hits += 1
+            self.__insert(key, coefs)
+        return Polynomial(coefs)
+
+    def __getitem__(self, rows):
+        poly = self.get(rows)
+        if poly is None:
+            raise KeyError(rows)
+        return poly
+
+    def __setitem__(self, rows, poly):
+        key = self.pack_key(rows)
+        with self.__lock:
+            self.__insert(key, poly.coefs)
+        if self.store is not None:
+            self.store.put(key, poly.coefs)
+
+    def __insert(self, key, coefs):
+        coefs = self.__pack_coefs(coefs)
+        if key in self.__entries:
+            self.nbytes -= self.__sizeof(key, self.__entries[key])
+        self.__entries[key] = coefs
+        self.__entries.move_to_end(key)
+        self.nbytes += self.__sizeof(key, coefs)
+        self.__evict()
+
+    def __evict(self):
+        while self.__entries and (
+                (self.max_entries is not None
+                 and len(self.__entries) > self.max_entries)
+                or (self.max_bytes is not None
+                    and self.nbytes > self.max_bytes)):
+            key, coefs = self.__entries.popitem(last=False)
+            self.nbytes -= self.__sizeof(key, coefs)
+            self.evictions += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """
+        :return: dict of the hit, miss and eviction counters and current size
+        """
+        with self.__lock:
+            return {"hits": self.hits, "store_hits": self.store_hits,
+                    "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self.__entries), "bytes": self.nbytes}
+
+    def reset_stats(self):
+        with self.__lock:
+            self.hits = self.store_hits = self.misses = self.evictions = 0
+
+
+class SolveCancelled(Exception):
+    """
+    Raised inside a solve once the board's cancel event is set
+    """
+
+
+class SolveStats:
+    """
+    Opt-in counters for Board.solve, readable while the solve runs. Each
+    subboard is counted once settled, by kind: "empty", "cache", the closed
+    forms "single_cell", "rect", "ferrers" and "sweep", or the expansions
+    "complement", "components" and "split" once their subboards are combined.
+    """
+    def __init__(self, on_enter=None, on_exit=None):
+        """
+        :param on_enter: called as on_enter(key, depth) when a subboard is
+                         looked up, key being its canonical form
+        :param on_exit: called as on_exit(key, depth, kind) once the
+                        subboard's polynomial is known
+        """
+        self.on_enter = on_enter
+        self.on_exit = on_exit
+        self.nodes = 0  # Subboards missing from the cache
+        self.max_depth = 0
+        self.kinds = collections.Counter()
+        # Seconds spent settling each kind of subboard, combine steps apart
+        self.seconds = collections.Counter()
+
+    def enter(self, key, depth):
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if self.on_enter is not None:
+            self.on_enter(key, depth)
+
+    def exit(self, key, depth, kind):
+        self.kinds[kind] += 1
+        if self.on_exit is not None:
+            self.on_exit(key, depth, kind)
+
+    @property
+    def cache_hits(self):
+        return self.kinds["cache"]
+
+    def as_dict(self):
+        """
+        :return: the counters as plain JSON-serializable values
+        """
+        return {"nodes": self.nodes, "cache_hits": self.cache_hits,
+                "max_depth": self.max_depth, "kinds": dict(self.kinds),
+                "seconds": dict(self.seconds)}
+
+
 class Board:
-    POLYNOMIAL_CACHE = {}
+    POLYNOMIAL_CACHE = PolynomialCache(max_bytes=256 * 2**20)
+    SWEEP_MAX_WIDTH = 24  # Widest band __sweep_rows is used on
+    SWEEP_MAX_STATES = 2**21  # Most sweep states expected at once
+    PERIOD_MAX = 16  # Longest row period __sweep_rows looks for
+    PERIOD_MIN_REPEATS = 4
+    PIVOT = "first"  # Key of Board.PIVOTS used to split boards
+    RYSER_MAX_SIZE = 32  # Largest square board count_placements uses Ryser on
+    cancel = None  # threading.Event stopping solves between subboards when set
 
     def __init__(self, h, w, bad_sqrs):
         self.height = h
         self.width = w
+        self.__counts = {}  # Memo of __placement_count
+        self.__counts_board = None
+        self.__solved = None  # Rows and polynomial of the last solve
+        self.__mirror = (None, None)  # Rows and column bitmasks of __columns
         self.board = [(2**w-1) for i in range(h)]
         # Represent binary array as array of ints
         for i in range(h):
@@ -101,184 +376,1263 @@ class Board:
             rows.append(" ".join(sqrs[::-1]))
         return "\n".join(rows)
 
-    def __is_single_cell(self):
-        rows = set(self.board)
+    def __columns(self):
+        """
+        Column-major mirror of board, kept in step by toggle_cells and rebuilt
+        only if board was changed some other way
+        :return: list of column bitmasks, row i stored at bit h - 1 - i
+        """
+        rows = tuple(self.board)
+        if self.__mirror[0] != rows:
+            self.__mirror = (rows, self.__transpose(rows, self.width))
+        return self.__mirror[1]
+
+    def column_degree(self, j):
+        """
+        :return: number of allowed cells in column j
+        """
+        return self.__columns()[j].bit_count()
+
+    def __is_single_cell(self, board):
+        rows = set(board)
         if len(rows) == 2 and 0 in rows:  # should be zero and a power of two
             for val in rows:
-                if val and self.board.count(val) > 1:
+                if val and board.count(val) > 1:
                     return False
                 if val != (val & -val):
                     return False
             return True
         return False
 
-    def __find_rect(self):
-        rows = self.board
+    def __find_rect(self, rows):
+        """
+        Every non-empty row allowing the same columns makes the board a full
+        rectangle up to row and column order, wherever its rows and columns lie
+        :return: (True, columns, rows) of the rectangle, (False, None, None) if
+                 the board is not one
+        """
         row_vals = set(rows) - {0}
         if len(row_vals) == 1:
-            val = next(iter(row_vals))
-            if self.__is_block(val):
-                x = self.__find_msb(val) - self.__find_lsb(val) + 1
-                first = rows.index(val)
-                last = len(rows) - rows[::-1].index(val)
-                if len(set(rows[first:last])) == 1:
-                    y = last - first
-                    return True, x, y
+            val = row_vals.pop()
+            return True, val.bit_count(), len(rows) - rows.count(0)
         return False, None, None
 
-    def __is_empty(self):
-        rows = set(self.board)
-        if rows == {0}:
-            return True
-        return False
+    @staticmethod
+    def __components(board):
+        """
+        Groups the non-empty rows into components that share no column
+        :return: list of row tuples, one per row/column-connected component
+        """
+        groups = []  # [column mask, rows] pairs with disjoint column masks
+        for row in board:
+            if not row:
+                continue
+            cols, rows = row, [row]
+            disjoint = []
+            for group in groups:
+                if group[0] & cols:  # Row links this group to the new one
+                    cols |= group[0]
+                    rows += group[1]
+                else:
+                    disjoint.append(group)
+            disjoint.append([cols, rows])
+            groups = disjoint
+        return [tuple(rows) for cols, rows in groups]
+
+    @staticmethod
+    def __transpose(rows, width):
+        """
+        :return: column bitmasks of the board, row i stored at bit h - 1 - i
+        """
+        if not rows:
+            return [0] * width
+        bits = [format(row, "0%db" % width) for row in rows]
+        return [int("".join(col), 2) for col in zip(*bits)]
+
+    def __sorted_rows(self, rows, width):
+        """
+        Strips empty rows and columns and sorts rows and columns in descending
+        order, alternating until the board no longer changes
+        :return: tuple of the sorted row bitmasks
+        """
+        rows = sorted((row for row in rows if row), reverse=True)
+        for _ in range(len(rows) + width + 1):
+            cols = sorted((col for col in self.__transpose(rows, width) if col),
+                          reverse=True)
+            width = len(cols)
+            sorted_rows = sorted(self.__transpose(cols, len(rows)), reverse=True)
+            if sorted_rows == rows:
+                break
+            rows = sorted_rows
+        return tuple(rows)
+
+    def __canonical_form(self, board, width):
+        """
+        Reduces the board to a form shared by its row/column permutations,
+        its transpose and any padding with empty rows and columns
+        :return: tuple of row bitmasks used as the POLYNOMIAL_CACHE key
+        """
+        rows = self.__sorted_rows(board, width)
+        if not rows:
+            return rows
+        width = rows[0].bit_length()  # Leading column is never empty
+        cols = self.__sorted_rows(self.__transpose(rows, width), len(rows))
+        return min(rows, cols, key=lambda form: (len(form), form))
+
+    @staticmethod
+    def __build_B_i_and_B_e(board, i, col):
+        """
+        Splits on the cell in row i and column bit col. Empty rows are
+        dropped from both subboards
+        :return: row tuples of the board with the cell's row and column
+                 deleted and of the board with only the cell deleted
+        """
+        # Delete the row and the column, masking every row at once
+        B_i = tuple(map((~col).__and__, board[:i] + board[i + 1:]))
+        if 0 in B_i:
+            B_i = tuple(filter(None, B_i))
+        # Delete the cell, its row is the only one to change
+        row = board[i] & ~col
+        B_e = board[:i] + (row,) * (row != 0) + board[i + 1:]
+        if 0 in B_e:
+            B_e = tuple(filter(None, B_e))
+        return B_i, B_e
+
+    def __pivot_first(self, board, width):
+        """
+        :return: the most significant cell of the first non-empty row
+        """
+        for i, row in enumerate(board):
+            if row:
+                return i, 1 << (row.bit_length() - 1)
+
+    def __pivot_densest(self, board, width):
+        """
+        :return: a cell of the densest row or column, taking the densest
+                 crossing line within it
+        """
+        cols = self.__transpose(board, width)
+        row_cnts = [row.bit_count() for row in board]
+        col_cnts = [col.bit_count() for col in cols]
+        i = max(range(len(board)), key=row_cnts.__getitem__)
+        j = max(range(width), key=col_cnts.__getitem__)
+        if row_cnts[i] >= col_cnts[j]:
+            j = max((j for j in range(width) if board[i] >> (width - 1 - j) & 1),
+                    key=col_cnts.__getitem__)
+        else:
+            i = max((i for i in range(len(board))
+                     if cols[j] >> (len(board) - 1 - i) & 1),
+                    key=row_cnts.__getitem__)
+        return i, 1 << (width - 1 - j)
 
-    def __build_B_i_and_B_e(self):
-        B_i = Board(self.height, self.width, {})
-        B_i.board = copy.deepcopy(self.board)
-        B_e = Board(self.height, self.width, {})
-        B_e.board = copy.deepcopy(self.board)
-        for i in range(B_i.height):
-            if B_i.board[i]:
-                msb = B_i.__find_msb(B_i.board[i])
-                B_e.board[i] &= ~(1 << (msb - 1))  # Delete cell
-                B_i.board[i] = 0  # Delete the row
-                for j in range(i, B_i.height):
-                    B_i.board[j] &= ~(1 << (msb - 1))  # Delete the column
-                return B_i, B_e
+    def __pivot_disconnect(self, board, width):
+        """
+        Looks for a bridge of the graph joining each row to its columns, a
+        cell whose deletion splits the board into independent components
+        :return: a bridge cell, the first cell if the board has none
+        """
+        h = len(board)
+        cols = self.__transpose(board, width)
+        # Rows are vertices 0..h-1 and columns h..h+width-1
+        adjacent = [[h + j for j in range(width) if row >> (width - 1 - j) & 1]
+                    for row in board]
+        adjacent += [[i for i in range(h) if col >> (h - 1 - i) & 1]
+                     for col in cols]
+        order = [None] * (h + width)
+        low = [0] * (h + width)
+        counter = 0
+        for root in range(h):
+            if order[root] is not None or not adjacent[root]:
+                continue
+            order[root] = low[root] = counter
+            counter += 1
+            stack = [(root, None, iter(adjacent[root]))]
+            while stack:
+                v, parent, neighbours = stack[-1]
+                for u in neighbours:
+                    if u == parent:
+                        continue
+                    if order[u] is None:
+                        order[u] = low[u] = counter
+                        counter += 1
+                        stack.append((u, v, iter(adjacent[u])))
+                        break
+                    low[v] = min(low[v], order[u])
+                else:
+                    stack.pop()
+                    if parent is not None:
+                        low[parent] = min(low[parent], low[v])
+                        if low[v] > order[parent]:
+                            i, j = (parent, v - h) if parent < h else (v, parent - h)
+                            return i, 1 << (width - 1 - j)
+        return self.__pivot_first(board, width)
+
+    def __pivot_shape(self, board, width):
+        """
+        :return: the cell leaving the most Ferrers subboards, rectangles
+                 included, the first cell if no cell leaves any
+        """
+        best, best_score = None, 0
+        for i, row in enumerate(board):
+            cells = row
+            while cells:
+                col = cells & -cells
+                cells ^= col
+                score = sum(self.__is_ferrers(sub) for sub in
+                            self.__build_B_i_and_B_e(board, i, col))
+                if score > best_score:
+                    best, best_score = (i, col), score
+                    if score == 2:
+                        return best
+        return best or self.__pivot_first(board, width)
+
+    # Pivot heuristics for the B_i/B_e split, called as f(self, rows, width)
+    # and returning the row index and column bit of the cell to split on
+    PIVOTS = {"first": __pivot_first, "densest": __pivot_densest,
+              "disconnect": __pivot_disconnect, "shape": __pivot_shape}
 
     def __binomial(self, n, k):
-        if n > 0:
-            return int(math.factorial(n) / (math.factorial(k) * math.factorial(n - k)))
-        elif n == 0:
-            return 0
+        if n >= 0:
+            return math.comb(n, k)
         elif n < 0:
             return None
 
-    def __rect_frp(self, x, y):
-        poly = Polynomial([])
+    def __rect_frp(self, x, y, modulus=None):
+        coefs = []
+        if modulus and min(x, y) < modulus:
+            # r_k = r_(k-1) * (x - k + 1) * (y - k + 1) / k, dividing by way of
+            # the inverse of k so the coefficients stay below the modulus
+            coef = 1
+            for k in range(min(x, y) + 1):
+                if k:
+                    coef = coef * (x - k + 1) * (y - k + 1) \
+                        * pow(k, -1, modulus) % modulus
+                coefs.append(coef)
+            return Polynomial(coefs)
         for k in range(min(x,y) + 1):
-            poly.coefs.append(self.__binomial(x, k) * self.__binomial(y, k) * math.factorial(k))
-        return poly
+            coefs.append(self.__binomial(x, k) * self.__binomial(y, k) * math.factorial(k))
+        poly = Polynomial(coefs)
+        return poly % modulus if modulus else poly
 
-    def __number_of_set_bits(self, n):
+    @staticmethod
+    def __is_ferrers(board):
         """
-        Taken from:
-        https://graphics.stanford.edu/~seander/bithacks.html#CountBitsSet64
+        :return: True if the rows are nested once sorted by length
         """
-        c = ((n & 0xfff) * 0x1001001001001 & 0x84210842108421) % 0x1f
-        c += (((n & 0xfff000) >> 12) * 0x1001001001001 & 0x84210842108421) %0x1f
-        c += ((n >> 24) * 0x1001001001001 & 0x84210842108421) % 0x1f
-        return c
+        rows = sorted(board, key=int.bit_count)
+        return all(not shorter & ~row for shorter, row in zip(rows, rows[1:]))
+
+    @staticmethod
+    def __ferrers_frp(key, modulus=None):
+        """
+        Closed form for Ferrers boards, whose rows are nested once sorted by
+        length. Following the Goldman-Joichi-White factorization, a rook in
+        row i has a_i - k choices when k rooks sit in the shorter rows, since
+        their columns all lie inside row i
+        :param key: canonical form of the board
+        :param modulus: prime the coefficients are reduced by, if any
+        :return: rook polynomial, None if the board is not a Ferrers board
+        """
+        if not Board.__is_ferrers(key):
+            return None
+        lengths = sorted(row.bit_count() for row in key)
+        coefs = [1]
+        for a_i in lengths:
+            coefs = [coef + coefs[k - 1] * (a_i - k + 1) if k else coef
+                     for k, coef in enumerate(coefs + [0])]
+            if modulus:
+                coefs = [coef % modulus for coef in coefs]
+        while len(coefs) > 1 and coefs[-1] == 0:
+            coefs.pop()
+        return Polynomial(coefs)
 
-    def __find_msb(self, n):
+    def __complement_frp(self, n, m, R_bar, modulus=None):
         """
-        Taken from:
-        https://graphics.stanford.edu/~seander/bithacks.html#CountBitsSet64
+        Inclusion-exclusion over the forbidden cells of an n x m board whose
+        complement B' has rook polynomial R_bar:
+        r_k(B) = sum_j (-1)^j * r_j(B') * r_(k-j) of the (n-j) x (m-j) rectangle
+        :return: rook polynomial of the board
         """
-        if n == 0:
+        rects = [self.__rect_frp(n - j, m - j, modulus)
+                 for j in range(len(R_bar))]
+        coefs = [0] * (min(n, m) + 1)
+        for j, coef in enumerate(R_bar.coefs):
+            if coef:
+                coef = -coef if j & 1 else coef
+                Polynomial.accumulate(coefs, [coef * c for c in rects[j].coefs], j)
+        poly = Polynomial(coefs)
+        return poly % modulus if modulus else poly
+
+    @staticmethod
+    def __sweep_masks(rows):
+        """
+        :return: list of masks of the columns whose last cell is in each row and
+                 list of masks of the live columns before each row, those used
+                 by an earlier row and by this or a later one
+        """
+        retire = [0] * len(rows)
+        seen = 0
+        for i in range(len(rows) - 1, -1, -1):
+            retire[i] = rows[i] & ~seen
+            seen |= rows[i]
+        live = []
+        cols = 0
+        for row, done in zip(rows, retire):
+            live.append(cols)
+            cols = (cols | row) & ~done
+        return retire, live
+
+    def __sweep_size(self, rows):
+        """
+        The states at a row are bounded both by the subsets of the columns
+        tracked there and by the states of the row before branching on its
+        cells, so sparse boards stay cheap to sweep even over wide bands
+        :return: (estimated most states, band width) of __sweep_rows for these
+                 rows, the band width being the most columns tracked at once
+        """
+        _, live = self.__sweep_masks(rows)
+        states = peak = band = 0
+        for row, cols in zip(rows, live):
+            tracked = (cols | row).bit_count()
+            # Each state branches once per free cell of the row at most
+            states = min(max(states, 1) * (row.bit_count() + 1), 1 << tracked)
+            peak = max(peak, states)
+            band = max(band, tracked)
+        return peak, band
+
+    @staticmethod
+    def __period_shift(rows, retire, live, i, p):
+        """
+        :return: s if row i + p is row i moved s columns right, together with
+                 its retiring and live columns, None otherwise
+        """
+        if i + p >= len(rows):
+            return None
+        s = rows[i].bit_length() - rows[i + p].bit_length()
+        if s >= 0 and rows[i + p] << s == rows[i] \
+                and retire[i + p] << s == retire[i] \
+                and live[i + p] << s == live[i]:
+            return s
+        return None
+
+    def __find_period(self, rows, retire, live):
+        """
+        Looks for a stretch of rows that repeats every p rows moved s columns
+        to the right, such as the middle of a diagonal band
+        :return: (start, p, s, repeats) for the stretch covering the most rows,
+                 None if nothing repeats at least PERIOD_MIN_REPEATS times
+        """
+        best = None
+        for p in range(1, min(self.PERIOD_MAX, len(rows) // 2) + 1):
+            start = shift = None
+            for i in range(len(rows) - p + 1):
+                s = self.__period_shift(rows, retire, live, i, p)
+                if start is not None and s == shift:
+                    continue
+                if start is not None:
+                    # Rows start..i-1 each repeat p rows later
+                    repeats = (i - 1 - start) // p + 1
+                    if repeats >= self.PERIOD_MIN_REPEATS and (
+                            best is None or repeats * p > best[1] * best[3]):
+                        best = (start, p, shift, repeats)
+                start, shift = (None, None) if s is None else (i, s)
+        return best
+
+    @staticmethod
+    def __sweep(states, rows, retire, width, modulus=None):
+        """
+        Advances the sweep states over the given rows. A state is the mask of
+        used live columns plus the number of rooks on retired columns shifted
+        above the board width, mapped to its number of placements.
+        """
+        for row, done in zip(rows, retire):
+            new_states = dict(states)  # No rook in this row
+            for state, cnt in states.items():
+                free = row & ~state
+                while free:
+                    col = free & -free
+                    free ^= col
+                    new_states[state | col] = new_states.get(state | col, 0) + cnt
+            if done:
+                states = {}
+                for state, cnt in new_states.items():
+                    if state & done:
+                        # Rooks on retired columns move into the counter
+                        state = (state & ~done) + (
+                            (state & done).bit_count() << width)
+                    states[state] = states.get(state, 0) + cnt
+            else:
+                states = new_states
+            if modulus:
+                states = {state: cnt % modulus for state, cnt in states.items()}
+        return states
+
+    @staticmethod
+    def __add_shifted(states, used, coefs, shift):
+        """
+        Adds coefs moved up by shift degrees to the coefficient list for used
+        """
+        acc = states.get(used)
+        if acc is None:
+            states[used] = [0] * shift + coefs
+        else:
+            Polynomial.accumulate(acc, coefs, shift)
+
+    def __repeat_period(self, states, rows, retire, width, shift, repeats,
+                        modulus=None):
+        """
+        Applies the transfer matrix of one period `repeats` times. States are
+        kept relative to the first period, each period moving them `shift`
+        columns right, so the matrix is built once per source state. Each
+        state holds a list of counts indexed by retired rooks, as the lists
+        grow long over a periodic stretch.
+        """
+        used_mask = (1 << width) - 1
+        polys = {}
+        for state, cnt in states.items():
+            self.__add_shifted(polys, state & used_mask, [cnt], state >> width)
+        transfer = {}
+        for _ in range(repeats):
+            new_polys = {}
+            for used, coefs in polys.items():
+                if used not in transfer:
+                    transfer[used] = [
+                        ((target & used_mask) << shift, target >> width, mult)
+                        for target, mult in
+                        self.__sweep({used: 1}, rows, retire, width,
+                                     modulus).items()]
+                for target, retired, mult in transfer[used]:
+                    self.__add_shifted(new_polys, target, coefs if mult == 1
+                                       else [coef * mult for coef in coefs],
+                                       retired)
+            if modulus:
+                for coefs in new_polys.values():
+                    coefs[:] = [coef % modulus for coef in coefs]
+            polys = new_polys
+        states = {}
+        for used, coefs in polys.items():
+            used >>= shift * repeats
+            for retired, cnt in enumerate(coefs):
+                if cnt:
+                    states[used + (retired << width)] = cnt
+        return states
+
+    def __sweep_rows(self, rows, modulus=None):
+        """
+        Transfer-matrix sweep down the rows over the sets of used columns
+        among the live ones. Takes time linear in the number of rows and
+        exponential only in the band width, and reuses the transfer matrix
+        across periodic stretches.
+        :return: rook polynomial of the board
+        """
+        retire, live = self.__sweep_masks(rows)
+        width = max(rows).bit_length()
+        states = {0: 1}
+        period = self.__find_period(rows, retire, live)
+        if period is None:
+            states = self.__sweep(states, rows, retire, width, modulus)
+        else:
+            start, p, shift, repeats = period
+            end = start + p * repeats
+            states = self.__sweep(states, rows[:start], retire[:start], width,
+                                  modulus)
+            states = self.__repeat_period(states, rows[start:start + p],
+                                          retire[start:start + p], width,
+                                          shift, repeats, modulus)
+            states = self.__sweep(states, rows[end:], retire[end:], width,
+                                  modulus)
+        # Every column has retired after the last row
+        coefs = [0] * (max(states) >> width) + [0]
+        for state, cnt in states.items():
+            coefs[state >> width] += cnt
+        return Polynomial(coefs) % modulus if modulus else Polynomial(coefs)
+
+    def __sweep_orders(self, board, width, key):
+        """
+        :return: row orders to consider for __sweep_rows, the board as given
+                 and in canonical form, each also transposed
+        """
+        rows = [row for row in board if row]
+        orders = [rows, self.__transpose(rows, width),
+                  list(key), self.__transpose(key, key[0].bit_length())]
+        return [[row for row in order if row] for order in orders]
+
+    def __sweep_choice(self, board, width, key):
+        """
+        The sweep takes time linear in the rows times the states, where the
+        split takes time exponential in the cells, so it is used whenever
+        its states fit in memory
+        :return: row order to pass to __sweep_rows, None if the board is too
+                 wide to sweep
+        """
+        (states, band), rows = min(
+            ((self.__sweep_size(rows), rows)
+             for rows in self.__sweep_orders(board, width, key)),
+            key=operator.itemgetter(0))
+        if band <= self.SWEEP_MAX_WIDTH and states <= self.SWEEP_MAX_STATES:
+            return rows
+        return None
+
+    def solve(self, cache=None, stats=None):
+        """
+        :param cache: stand-in for POLYNOMIAL_CACHE, used instead of it
+        :param stats: SolveStats filled in as the solve goes, left out of the
+                      solve entirely when None
+        :return: rook polynomial of the board
+        """
+        R_of_B, _ = self.__solve_rows(
+            tuple(self.board), self.width,
+            self.POLYNOMIAL_CACHE if cache is None else cache,
+            self.PIVOTS[self.PIVOT], stats=stats)
+        self.__solved = (tuple(self.board), R_of_B)
+        return R_of_B
+
+    def toggle_cells(self, cells, cache=None):
+        """
+        Adds each cell to the board if missing and removes it otherwise,
+        updating the polynomial of the last solve by
+        R(B with c) = R(B without c) + x * R(B without c's row and column),
+        so an edit only solves the board left by deleting a row and a column,
+        mostly out of cached subboards. Solves from scratch if the board
+        changed since.
+        :param cells: iterable of (row, column) cells, toggled in order
+        :param cache: stand-in for POLYNOMIAL_CACHE, used instead of it
+        :return: rook polynomial of the edited board
+        """
+        cache = self.POLYNOMIAL_CACHE if cache is None else cache
+        if self.__solved is None or self.__solved[0] != tuple(self.board):
+            self.solve(cache)
+        R_of_B = self.__solved[1]
+        columns = self.__columns()
+        h = len(self.board)
+        for i, j in cells:
+            if not (0 <= i < h and 0 <= j < self.width):
+                raise ValueError("cell (%d, %d) is outside the board" % (i, j))
+            col = 1 << (self.width - 1 - j)
+            rest = tuple(map((~col).__and__, self.board[:i] + self.board[i + 1:]))
+            R_of_rest, _ = self.__solve_rows(rest, self.width, cache,
+                                             self.PIVOTS[self.PIVOT])
+            if self.board[i] & col:
+                R_of_B = (R_of_B - R_of_rest.shift(1)).trim()
+            else:
+                R_of_B = R_of_B.add_shifted(R_of_rest, 1)
+            self.board[i] ^= col
+            columns[j] ^= 1 << (h - 1 - i)
+            self.__solved = (tuple(self.board), R_of_B)
+            self.__mirror = (self.__solved[0], columns)
+        return R_of_B
+
+    def toggle_cell(self, i, j, cache=None):
+        """
+        :return: rook polynomial once cell (i, j) is toggled, see toggle_cells
+        """
+        return self.toggle_cells([(i, j)], cache)
+
+    def solve_modular(self, modulus):
+        """
+        Solves with every coefficient reduced modulo a prime as the solve
+        goes, for callers that only need the counts modulo p. Uses a cache of
+        its own, as the reduced polynomials must not mix with exact ones.
+        :param modulus: prime to reduce the coefficients by
+        :return: rook polynomial of the board with coefficients reduced by
+                 modulus
+        """
+        if not self.__is_prime(modulus):
+            raise ValueError("modulus %d is not a prime" % modulus)
+        R_of_B, _ = self.__solve_rows(
+            tuple(self.board), self.width,
+            PolynomialCache(
+                max_bytes=getattr(self.POLYNOMIAL_CACHE, "max_bytes", None)),
+            self.PIVOTS[self.PIVOT], modulus)
+        return R_of_B
+
+    @staticmethod
+    def __is_prime(n):
+        """
+        Miller-Rabin with the first twelve prime bases, deterministic below
+        3.3 * 10**24
+        """
+        bases = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+        if n < 2 or any(n % p == 0 for p in bases):
+            return n in bases
+        d, r = n - 1, 0
+        while not d & 1:
+            d >>= 1
+            r += 1
+        for a in bases:
+            x = pow(a, d, n)
+            if x in (1, n - 1):
+                continue
+            for _ in range(r - 1):
+                x = x * x % n
+                if x == n - 1:
+                    break
+            else:
+                return False
+        return True
+
+    def solve_parallel(self, workers=None, depth=4, cache=None, executor=None):
+        """
+        Expands the top levels of the tree here, then solves the distinct
+        subboards left at the frontier in a process pool. The cache entries
+        each worker adds are merged back into the cache.
+        :param workers: pool size, os.cpu_count() if None
+        :param depth: number of levels expanded before handing off
+        :param cache: stand-in for POLYNOMIAL_CACHE, used instead of it
+        :param executor: existing concurrent.futures executor to submit to
+        :return: rook polynomial of the board
+        """
+        cache = self.POLYNOMIAL_CACHE if cache is None else cache
+        R_of_B, _ = self.__solve_frontier(depth, cache, executor, workers)
+        return R_of_B
+
+    def parallel_speedup(self, workers=None, depth=4):
+        """
+        Times a cold serial solve against a cold solve_parallel, whose pool
+        workers start from empty caches rather than any inherited by fork
+        :return: dict of both wall times in seconds, their ratio and the
+                 number of distinct frontier subboards sent to the pool
+        """
+        start = time.perf_counter()
+        self.solve(cache={})
+        serial = time.perf_counter() - start
+        start = time.perf_counter()
+        max_bytes = getattr(self.POLYNOMIAL_CACHE, "max_bytes", None)
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_init_worker,
+                initargs=(None, max_bytes, None)) as pool:
+            _, frontier = self.__solve_frontier(depth, {}, pool, workers)
+        parallel = time.perf_counter() - start
+        return {"serial_seconds": serial, "parallel_seconds": parallel,
+                "speedup": serial / parallel, "frontier": frontier,
+                "workers": workers or os.cpu_count()}
+
+    def __solve_frontier(self, depth, cache, executor, workers):
+        """
+        :return: rook polynomial of the board and the number of subboards
+                 solved in the pool
+        """
+        pivot = self.PIVOTS[self.PIVOT]
+        root = self.__canonical_form(self.board, self.width)
+        level = {root: (tuple(self.board), self.width)}
+        tree = {}  # Canonical key -> (combine, child keys) of expanded nodes
+        results = {}
+        frontier = {}  # Distinct subboards left for the pool
+        for d in range(depth + 1):
+            next_level = {}
+            for key, (board, width) in level.items():
+                if key in tree or key in results or key in frontier:
+                    continue
+                R_of_B = cache.get(key) if key else Polynomial([1])
+                if R_of_B is not None:
+                    results[key] = R_of_B
+                    continue
+                if d == depth:
+                    frontier[key] = (board, width)
+                    continue
+                kind, R_of_B, combine, children = self.__expand(
+                    board, width, key, pivot)
+                if R_of_B is not None:
+                    cache[key] = results[key] = R_of_B
+                    continue
+                child_keys = [self.__canonical_form(*child) for child in children]
+                tree[key] = (combine, child_keys)
+                for child_key, child in zip(child_keys, children):
+                    next_level.setdefault(child_key, child)
+            level = next_level
+        if frontier:
+            pool = executor or concurrent.futures.ProcessPoolExecutor(workers)
+            try:
+                futures = {key: pool.submit(_solve_subboard, board, width,
+                                            self.PIVOT)
+                           for key, (board, width) in frontier.items()}
+                for key, future in futures.items():
+                    coefs, entries = future.result()
+                    for entry_key, entry_coefs in entries:
+                        cache[entry_key] = Polynomial(entry_coefs)
+                    results[key] = Polynomial(coefs)
+            finally:
+                if executor is None:
+                    pool.shutdown()
+        stack = [root]  # Combine the expanded nodes children first
+        while stack:
+            key = stack[-1]
+            if key in results:
+                stack.pop()
+                continue
+            combine, child_keys = tree[key]
+            unsolved = [child for child in child_keys if child not in results]
+            if unsolved:
+                stack.extend(unsolved)
+                continue
+            R_of_B = combine([results[child] for child in child_keys])
+            cache[key] = results[key] = R_of_B
+        return results[root], len(frontier)
+
+    def compare_pivots(self, pivots=None):
+        """
+        Solves the board once per pivot heuristic, each with an empty cache
+        :param pivots: keys of Board.PIVOTS to compare, all of them if None
+        :return: dict mapping each heuristic to the number of subboards
+                 expanded
+        """
+        nodes = {}
+        for name in pivots or self.PIVOTS:
+            R_of_B, nodes[name] = self.__solve_rows(
+                tuple(self.board), self.width, {}, self.PIVOTS[name])
+        return nodes
+
+    def count_placements(self, num_rooks, workers=None, executor=None):
+        """
+        Coefficient of x**num_rooks in the rook polynomial. The complete
+        placements of a square board are counted as the permanent of its
+        0/1 matrix with Ryser's formula, visiting the column subsets in Gray
+        code order so each term updates the row sums by a single column.
+        Other coefficients are read off the solved polynomial.
+        :param workers: number of processes the Ryser sum is split across,
+                        summed here if None and no executor is given
+        :param executor: existing concurrent.futures executor to submit to
+        :return: number of placements of num_rooks non-attacking rooks
+        """
+        n = len(self.board)
+        if num_rooks == 0:
+            return 1
+        if not 0 < num_rooks <= min(n, self.width):
             return 0
+        if num_rooks < n or n != self.width or n > self.RYSER_MAX_SIZE:
+            coefs = self.solve().coefs
+            return coefs[num_rooks] if num_rooks < len(coefs) else 0
+        if not all(self.board) or \
+                functools.reduce(operator.or_, self.board) != (1 << n) - 1:
+            return 0  # An empty row or column
+        # Closed forms and solved boards are cheaper than the 2**n terms
+        key = self.__canonical_form(self.board, self.width)
+        R_of_B = self.POLYNOMIAL_CACHE.get(key)
+        if R_of_B is None:
+            R_of_B = self.__ferrers_frp(key)
+        if R_of_B is None and self.__solves_without_split(key):
+            R_of_B = self.solve()
+        if R_of_B is not None:
+            return R_of_B.coefs[n] if n < len(R_of_B.coefs) else 0
+        return self.__permanent(workers, executor)
 
-        b = [0x2, 0xC, 0xF0, 0xFF00, 0xFFFF0000]
-        S = [1, 2, 4, 8, 16]
-        r = 0
-        for i in range(4, -1, -1):
-            if n & b[i]:
-                n >>= S[i]
-                r |= S[i]
-        return r + 1
-
-    def __find_lsb(self, n):
-        return self.__find_msb(n & ~(n-1))
-
-    def __is_block(self, n):
-        x_1 = self.__find_msb(n)
-        x_2 = self.__find_lsb(n)
-        cnt = self.__number_of_set_bits(n)
-        return (cnt - 1) == (x_1 - x_2)
-
-    def solve(self):
-        is_rect, x, y = self.__find_rect()
-        if tuple(self.board) in self.POLYNOMIAL_CACHE:
-            return self.POLYNOMIAL_CACHE[tuple(self.board)]
-        elif self.__is_empty():
-            return Polynomial([1])
-        elif self.__is_single_cell():
-            return Polynomial([1, 1])
-        elif is_rect:
-            R_of_B = self.__rect_frp(x,y)
-            self.POLYNOMIAL_CACHE[tuple(self.board)] = R_of_B
-            return R_of_B
+    def __solves_without_split(self, key):
+        """
+        :return: whether __expand reduces the board by the sweep or its
+                 components, directly or on its complement, rather than
+                 splitting it on a cell, which takes polynomial time where
+                 Ryser takes 2**n terms
+        """
+        if not key:
+            return True
+        n, m = len(key), key[0].bit_length()
+        if 2 * sum(row.bit_count() for row in key) > n * m:
+            # The complement is expanded instead, and is sparse
+            complement = tuple(((1 << m) - 1) ^ row for row in key)
+            return self.__solves_without_split(
+                self.__canonical_form(complement, m))
+        return self.__sweep_choice(key, m, key) is not None \
+            or len(self.__components(key)) > 1
+
+    def __permanent(self, workers, executor):
+        """
+        Ryser's formula, per(A) = (-1)**n sum over column subsets S of
+        (-1)**|S| times the product of the row sums over S. The row sums are
+        packed one byte per row into a single int so a Gray code step is one
+        addition, and the product is taken over its bytes.
+        :return: permanent of the board
+        """
+        n = len(self.board)
+        columns = [sum(1 << 8 * i for i in range(n) if col >> (n - 1 - i) & 1)
+                   for col in self.__columns()]
+        if workers is None and executor is None:
+            total = _ryser_range(columns, n, 1, 1 << n)
         else:
-            B_i, B_e = self.__build_B_i_and_B_e()
-            R_of_B = B_e.solve() + (B_i.solve() * Polynomial([0, 1]))
-            self.POLYNOMIAL_CACHE[tuple(self.board)] = R_of_B
-            return R_of_B
+            pool = executor or concurrent.futures.ProcessPoolExecutor(workers)
+            chunks = 4 * (workers or os.cpu_count())
+            bounds = [1 + ((1 << n) - 1) * c // chunks
+                      for c in range(chunks + 1)]
+            try:
+                futures = [pool.submit(_ryser_range, columns, n, start, stop)
+                           for start, stop in zip(bounds, bounds[1:])
+                           if start < stop]
+                total = sum(future.result() for future in futures)
+            finally:
+                if executor is None:
+                    pool.shutdown()
+        return -total if n & 1 else total
+
+    def __solve_rows(self, board, width, cache, pivot, modulus=None,
+                     stats=None):
+        """
+        Expands the board with an explicit work stack rather than recursion.
+        Subboards are tuples of row bitmasks. A subboard that needs others
+        solved first is pushed back beneath them as a combine step, and
+        solved subboards are kept only while a combine step still needs them.
+        :param cache: POLYNOMIAL_CACHE or a stand-in for it
+        :param pivot: function from Board.PIVOTS choosing the split cell
+        :param modulus: prime every polynomial is reduced by, if any
+        :param stats: SolveStats to fill in, if any
+        :return: rook polynomial of the board and number of subboards
+                 expanded
+        """
+        root = self.__canonical_form(board, width)
+        depths = {root: 0}  # Only kept up to date for stats
+        results = {}  # Canonical key -> polynomial of a solved subboard
+        pending = collections.Counter({root: 1})  # Combine steps needing a key
+        # Entries are (None, key, board, width) for a subboard to solve and
+        # (combine, key, child keys, kind) for a combine step
+        stack = [(None, root, board, width)]
+        nodes = 0
+        while stack:
+            if self.cancel is not None and self.cancel.is_set():
+                raise SolveCancelled("solve cancelled")
+            combine, key, board, width = stack.pop()
+            if combine is not None:
+                child_keys, kind = board, width
+                if stats is None:
+                    R_of_B = combine([results[child] for child in child_keys])
+                else:
+                    start = time.perf_counter()
+                    R_of_B = combine([results[child] for child in child_keys])
+                    stats.seconds["combine"] += time.perf_counter() - start
+                    stats.exit(key, depths[key], kind)
+                if modulus:
+                    R_of_B %= modulus
+                for child in child_keys:
+                    pending[child] -= 1
+                    if not pending[child]:
+                        del pending[child]
+                        del results[child]
+                cache[key] = results[key] = R_of_B
+                continue
+            if key in results:  # Solved earlier for another combine step
+                continue
+            if stats is not None:
+                stats.enter(key, depths[key])
+            if not key:
+                results[key] = Polynomial([1])
+                if stats is not None:
+                    stats.exit(key, depths[key], "empty")
+                continue
+            R_of_B = cache.get(key)
+            if R_of_B is not None:
+                results[key] = R_of_B
+                if stats is not None:
+                    stats.exit(key, depths[key], "cache")
+                continue
+            nodes += 1
+            if stats is None:
+                kind, R_of_B, combine, children = self.__expand(
+                    board, width, key, pivot, modulus)
+            else:
+                stats.nodes += 1
+                start = time.perf_counter()
+                kind, R_of_B, combine, children = self.__expand(
+                    board, width, key, pivot, modulus)
+                stats.seconds[kind] += time.perf_counter() - start
+            if R_of_B is not None:
+                cache[key] = results[key] = R_of_B
+                if stats is not None:
+                    stats.exit(key, depths[key], kind)
+                continue
+            child_keys = [self.__canonical_form(*child) for child in children]
+            stack.append((combine, key, child_keys, kind))
+            for child_key, (child, child_width) in zip(child_keys, children):
+                pending[child_key] += 1
+                stack.append((None, child_key, child, child_width))
+                if stats is not None:
+                    depths[child_key] = depths[key] + 1
+        return results[root], nodes
+
+    def __expand(self, board, width, key, pivot, modulus=None):
+        """
+        Solves a non-empty board missing from the cache, or splits it into
+        subboards
+        :param key: canonical form of the board
+        :param modulus: prime the closed forms are reduced by, if any
+        :return: (kind, polynomial, None, None) when solved directly,
+                 otherwise (kind, None, combine, subboards) where combine maps
+                 the subboards' polynomials to this board's and each subboard
+                 is a (row tuple, width) pair. kind names the shortcut or
+                 expansion taken, as counted by SolveStats
+        """
+        if self.__is_single_cell(board):
+            return "single_cell", Polynomial([1, 1]), None, None
+        is_rect, x, y = self.__find_rect(board)
+        if is_rect:
+            return "rect", self.__rect_frp(x, y, modulus), None, None
+        R_of_B = self.__ferrers_frp(key, modulus)
+        if R_of_B is not None:
+            return "ferrers", R_of_B, None, None
+        n, m = len(key), key[0].bit_length()
+        cells = sum(row.bit_count() for row in key)
+        if 2 * cells > n * m:
+            # Fewer forbidden cells than allowed ones, so expand the former
+            complement = tuple(((1 << m) - 1) ^ row for row in key)
+            return "complement", None, \
+                lambda polys: self.__complement_frp(n, m, polys[0], modulus), \
+                [(complement, m)]
+        rows = self.__sweep_choice(board, width, key)
+        if rows is not None:
+            return "sweep", self.__sweep_rows(rows, modulus), None, None
+        components = self.__components(board)
+        if len(components) > 1:
+            # Components share no row or column, so R(B) = R(B_1)...R(B_n)
+            return "components", None, self.__multiply, \
+                [(component, width) for component in components]
+        B_i, B_e = self.__build_B_i_and_B_e(board, *pivot(self, board, width))
+        return "split", None, self.__add_B_i_and_B_e, \
+            [(B_i, width), (B_e, width)]
+
+    @staticmethod
+    def __multiply(polys):
+        return functools.reduce(operator.mul, polys)
+
+    @staticmethod
+    def __add_B_i_and_B_e(polys):
+        R_of_B_i, R_of_B_e = polys
+        return R_of_B_e.add_shifted(R_of_B_i, 1)
+
+    def __placement_count(self, i, used, k):
+        """
+        Number of ways to place k rooks in rows i onwards avoiding the used
+        columns. Polynomials are memoized per (i, used) for the current rows
+        on top of the POLYNOMIAL_CACHE lookups.
+        """
+        board = tuple(self.board)
+        if board != self.__counts_board:
+            self.__counts, self.__counts_board = {}, board
+        coefs = self.__counts.get((i, used))
+        if coefs is None:
+            R_of_B, _ = self.__solve_rows(
+                tuple(row & ~used for row in board[i:]), self.width,
+                self.POLYNOMIAL_CACHE, self.PIVOTS[self.PIVOT])
+            coefs = self.__counts[(i, used)] = R_of_B.coefs
+        return coefs[k] if 0 <= k < len(coefs) else 0
+
+    def __unrank(self, num_rooks, rank):
+        """
+        Placements are ranked row by row, a row left empty coming before a
+        rook in it and rooks ordered by column.
+        :return: list of the column masks chosen in each row, 0 for an empty
+                 row, up to the row of the last rook
+        """
+        choices = []
+        used = 0
+        k = num_rooks
+        for i, row in enumerate(self.board):
+            if not k:
+                break
+            count = self.__placement_count(i + 1, used, k)  # Row left empty
+            col = 0
+            free = row & ~used
+            while rank >= count:
+                rank -= count
+                col = 1 << (free.bit_length() - 1)
+                free ^= col
+                count = self.__placement_count(i + 1, used | col, k - 1)
+            choices.append(col)
+            used |= col
+            k -= col != 0
+        return choices
+
+    def unrank_placement(self, num_rooks, rank):
+        """
+        :return: set of (row, column) cells of the placement of num_rooks
+                 rooks at the given rank, 0 <= rank < number of placements
+        """
+        if num_rooks < 0:
+            raise ValueError("negative number of rooks %d" % num_rooks)
+        if not 0 <= rank < self.__placement_count(0, 0, num_rooks):
+            raise ValueError("rank %d out of range for %d rooks"
+                             % (rank, num_rooks))
+        return {(i, self.width - col.bit_length())
+                for i, col in enumerate(self.__unrank(num_rooks, rank)) if col}
+
+    def placements(self, num_rooks, start=0, stop=None):
+        """
+        Generates the placements of num_rooks non-attacking rooks in rank order
+        (see unrank_placement) from rank start up to rank stop, exclusive.
+        The search jumps straight to start using the placement counts, then
+        walks the rows depth first, pruning branches without enough rows or
+        free columns left for the remaining rooks.
+        :return: generator of sets of (row, column) cells
+        """
+        if num_rooks < 0:
+            raise ValueError("negative number of rooks %d" % num_rooks)
+        board = tuple(self.board)
+        total = self.__placement_count(0, 0, num_rooks)
+        stop = total if stop is None else min(stop, total)
+        if not 0 <= start < stop:
+            return
+        # Columns and number of non-empty rows from each row down
+        reach = [0] * (len(board) + 1)
+        rows_left = [0] * (len(board) + 1)
+        for i in range(len(board) - 1, -1, -1):
+            reach[i] = reach[i + 1] | board[i]
+            rows_left[i] = rows_left[i + 1] + (board[i] != 0)
+
+        def feasible(i, used, k):
+            return k == 0 or (rows_left[i] >= k
+                              and (reach[i] & ~used).bit_count() >= k)
+
+        # One frame per row on the current path: row, columns used above it,
+        # rooks left and the choice taken in it (None before the first one)
+        frames = [[0, 0, num_rooks, None]]
+        for col in self.__unrank(num_rooks, start):
+            i, used, k, _ = frames[-1]
+            frames[-1][3] = col
+            frames.append([i + 1, used | col, k - (col != 0), None])
+
+        for _ in range(stop - start):
+            # The path always ends at a complete placement here
+            yield {(i, self.width - col.bit_length())
+                   for i, used, k, col in frames[:-1] if col}
+            frames.pop()
+            while frames:
+                frame = frames[-1]
+                i, used, k, col = frame
+                free = board[i] & ~used
+                if col is None and feasible(i + 1, used, k):
+                    col = 0  # Leave the row empty first
+                else:
+                    if not col:
+                        col = 1 << free.bit_length()
+                    free &= col - 1
+                    while free:
+                        col = 1 << (free.bit_length() - 1)
+                        if feasible(i + 1, used | col, k - 1):
+                            break
+                        free ^= col
+                    else:
+                        frames.pop()  # Row exhausted, backtrack
+                        continue
+                frame[3] = col
+                frames.append([i + 1, used | col, k - (col != 0), None])
+                if frames[-1][2] == 0:
+                    break
+
+    def placement_shards(self, num_rooks, shards):
+        """
+        Splits the placements of num_rooks rooks into contiguous rank ranges
+        of near equal size, one per worker, each to be passed to placements.
+        :return: list of (start, stop) pairs
+        """
+        total = self.__placement_count(0, 0, num_rooks)
+        return [(total * n // shards, total * (n + 1) // shards)
+                for n in range(shards)]
+
+    def sample_configs(self, num_rooks, count, rng=random):
+        """
+        Draws placements of num_rooks non-attacking rooks, each placement
+        equally likely, by unranking uniformly random ranks.
+        :param rng: source of randomness with a randrange method
+        :return: list of count sets of (row, column) cells
+        """
+        total = self.__placement_count(0, 0, num_rooks)
+        if total == 0:
+            raise ValueError("the board has no placement of %d rooks"
+                             % num_rooks)
+        return [self.unrank_placement(num_rooks, rng.randrange(total))
+                for _ in range(count)]
 
     def disp_random_config(self, num_rooks):
-        # Displays a random valid configuration of rooks
-        board = copy.deepcopy(self.board)
-        cords = set()
-        rooks = set()
-        cnt = 0
-        num = 0
-        for i in range(self.height):
-            for j in range(self.width):
-                if board[i] & (1 << (self.width - 1 - j)):
-                    cords.add((i, j))
-        # find a valid configuration using num_rooks
-        while num < num_rooks:
-            num = 0
-            tmp_cords = copy.deepcopy(cords)
-            rooks = set()
-            cnt += 1
-            while len(tmp_cords) > 0 and num < num_rooks:
-                chosen = random.sample(tmp_cords, 1)[0]
-                tmp_cords.remove(chosen)
-                rooks.add(chosen)
-                num += 1
-                board[chosen[0]] = 0  # Delete row in board
-                for i in range(self.height):
-                    if (i, chosen[1]) in tmp_cords:
-                        tmp_cords.remove((i, chosen[1]))
-                    for j in range(self.width):
-                        if (chosen[0], j) in tmp_cords:
-                            tmp_cords.remove((chosen[0], j))
-                        board[i] &= ~(1 << j)  # Delete the column
-        return rooks
-
-def main():
-    # hw = input(
-    #     "Input height and width of board separated by a comma and hit enter: ")
-    # h = int(hw[:hw.index(',')])
-    # w = int(hw[hw.index(',') + 1:])
-    # b = set(input("Input space separated tuples of forbidden squares and hit "
-    #               "enter. Leave blank for full board. i.e 0,1 1,0 2,5...: "
-    #               ).strip(" ").split(' '))
-    # bad = set()
-    # print(b)
-    # if b != {''}:
-    #     for elem in b:
-    #         bad.add((int(elem[0]), int(elem[2])))
-    # print("\nheight: ", h)
-    # print("width: ", w)
-    # print("forbidden squares: ", bad)
-    # brd = Board(h, w, bad)
-    # print("\nboard:")
-    # print(brd)
-    # start = time.time()
-    # print("rook polynomial: ", brd.solve())
-    # print("run time: ", round(time.time() - start, 3), "seconds")
-    # board = Board(4, 4, {(3,3), (2,2), (1,1), (0,0)})
-    # print(board)
-    # print(board.solve())
-    # board.disp_random_config(4)
-    p1 = Polynomial([1, 1, 1])
-    p2 = Polynomial([1, 1])
-    print(p1 + p2)
+        """
+        :return: set of (row, column) cells of a uniformly random placement
+                 of num_rooks non-attacking rooks
+        """
+        return self.sample_configs(num_rooks, 1)[0]
 
-if __name__ == "__main__":
-    main()
+
+class _RecordingCache:
+    """
+    Cache stand-in for process pool workers that remembers the entries added
+    on top of the worker's own POLYNOMIAL_CACHE
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.added = {}
+
+    def get(self, key, default=None):
+        return self.cache.get(key, default)
+
+    def __setitem__(self, key, poly):
+        self.cache[key] = poly
+        self.added[key] = poly
+
+
+def _solve_subboard(board, width, pivot):
+    """
+    Process pool task of Board.solve_parallel
+    :return: coefficients of the subboard and the cache entries it added
+    """
+    sub = Board(0, width, {})
+    sub.board = list(board)
+    sub.height = len(board)
+    sub.PIVOT = pivot
+    cache = _RecordingCache(Board.POLYNOMIAL_CACHE)
+    R_of_B = sub.solve(cache=cache)
+    return R_of_B.coefs, [(key, poly.coefs) for key, poly in cache.added.items()]
+
+
+def _ryser_range(columns, n, start, stop):
+    """
+    Process pool task of Board.count_placements: the Ryser terms of the
+    column subsets given by Gray codes start to stop - 1, start >= 1
+    :param columns: each column's cells as one byte per row of an int
+    :return: sum of the terms, signed by the parity of the subset size
+    """
+    gray = (start - 1) ^ ((start - 1) >> 1)
+    sums = sum(column for j, column in enumerate(columns) if gray >> j & 1)
+    even = odd = 0
+    prod = math.prod
+    for g in range(start, stop):
+        j = (g & -g).bit_length() - 1  # Column toggled by this Gray code step
+        if g >> j & 2:
+            sums -= columns[j]
+        else:
+            sums += columns[j]
+        # Subsets alternate in size parity along the Gray code
+        if g & 1:
+            odd += prod(sums.to_bytes(n, "little"))
+        else:
+            even += prod(sums.to_bytes(n, "little"))
+    return even - odd
+
+
+def _init_worker(max_entries, max_bytes, store_path):
+    """
+    Process pool initializer of solve_stream and Board.parallel_speedup,
+    installing a POLYNOMIAL_CACHE configured like the parent's whatever the
+    start method of the pool
+    """
+    store = PolynomialStore(store_path) if store_path else None
+    Board.POLYNOMIAL_CACHE = PolynomialCache(max_entries, max_bytes, store)
+
+
+def _solve_board(board, width, pivot):
+    """
+    Process pool task of solve_stream
+    :return: coefficients of the rook polynomial
+    """
+    sub = Board(0, width, {})
+    sub.board = list(board)
+    sub.height = len(board)
+    sub.PIVOT = pivot
+    return sub.solve().coefs
+
+
+def read_boards(stream):
+    """
+    Lazily parses boards from JSONL lines of the form
+    {"height": 8, "width": 8, "forbidden": [[0, 1], [2, 3]]}
+    :return: generator of (record, Board) pairs, blank lines skipped
+    """
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            board = Board(int(record["height"]), int(record["width"]),
+                          {(int(i), int(j))
+                           for i, j in record.get("forbidden", ())})
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError("line %d: invalid board: %s" % (line_no, e))
+        yield record, board
 
 
+def solve_stream(boards, workers=0, window=None):
+    """
+    Solves boards in order, sharing one warm cache. With workers the boards
+    are spread over a process pool, each process keeping its own cache
+    configured like POLYNOMIAL_CACHE and sharing its store if any, and
+    at most `window` boards are in flight so memory stays flat however long
+    the stream is.
+    :param boards: iterable of Board
+    :param workers: pool size, 0 to solve in this process
+    :param window: boards in flight at once, 4 per worker if None
+    :return: generator of rook polynomials in input order
+    """
+    if not workers:
+        for board in boards:
+            yield board.solve()
+        return
+    window = window or 4 * workers
+    cache = Board.POLYNOMIAL_CACHE
+    if isinstance(cache, PolynomialCache):
+        store = cache.store.path if cache.store is not None else None
+        pool_args = {"initializer": _init_worker,
+                     "initargs": (cache.max_entries, cache.max_bytes, store)}
+    else:
+        pool_args = {}  # A stand-in cache cannot be rebuilt in the workers
+    with concurrent.futures.ProcessPoolExecutor(workers, **pool_args) as pool:
+        in_flight = collections.deque()
+        for board in boards:
+            in_flight.append(pool.submit(_solve_board, tuple(board.board),
+                                         board.width, board.PIVOT))
+            if len(in_flight) >= window:
+                yield Polynomial(in_flight.popleft().result())
+        while in_flight:
+            yield Polynomial(in_flight.popleft().result())
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="RookPolynomials",
+                                     description="Rook polynomial solver")
+    commands = parser.add_subparsers(dest="command")
+    solve_parser = commands.add_parser(
+        "solve", help="solve a JSONL stream of boards",
+        description="Reads one board per line as "
+                    '{"height": h, "width": w, "forbidden": [[i, j], ...]} '
+                    'and writes {"coefficients": [...]} per board in input '
+                    "order, copying any \"id\" field.")
+    solve_parser.add_argument("input", nargs="?", default="-",
+                              help="JSONL file of boards, - for stdin")
+    solve_parser.add_argument("-o", "--output", default="-",
+                              help="file for the results, - for stdout")
+    solve_parser.add_argument("-j", "--workers", type=int, default=0,
+                              help="size of the process pool, 0 to solve in "
+                                   "this process")
+    solve_parser.add_argument("--cache-mb", type=float, default=256,
+                              help="memory budget of the polynomial cache")
+    solve_parser.add_argument("--store",
+                              help="SQLite file shared as a persistent cache")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return
+
+    store = PolynomialStore(args.store) if args.store else None
+    Board.POLYNOMIAL_CACHE = PolynomialCache(
+        max_bytes=int(args.cache_mb * 2**20), store=store)
+    src, out = sys.stdin, sys.stdout
+    try:
+        if args.input != "-":
+            src = open(args.input)
+        if args.output != "-":
+            out = open(args.output, "w")
+        records = collections.deque()  # Records of the boards in flight
+
+        def boards():
+            for record, board in read_boards(src):
+                records.append(record)
+                yield board
+
+        for poly in solve_stream(boards(), args.workers):
+            result = {"coefficients": poly.coefs}
+            record = records.popleft()
+            if "id" in record:
+                result = {"id": record["id"], **result}
+            out.write(json.dumps(result) + "\n")
+    except (ValueError, OSError) as e:
+        parser.exit(1, "RookPolynomials: error: %s\n" % e)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()